@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# kimnaty
+# Copyright (C) 2024  Maurice (mausy5043) Hendrix
+# AGPL-3.0-or-later  - see LICENSE
+
+"""Benchmark laying out the trend data of many rooms side by side.
+
+Compares the per-room chain of outer merges that trend.py used to do with the
+single reshape of `trend.pivot_rooms()` on synthetic samples, and checks that
+both produce the same graphs data, e.g.:
+    python3 bench_pivot.py --years 3 --aggregation h
+"""
+
+import argparse
+import contextlib
+import os
+import sqlite3 as s3
+import tempfile
+import time
+from collections.abc import Callable
+
+import constants
+import kimdb
+import numpy as np
+import pandas as pd
+import rollup
+
+
+def synthetic_rooms(
+    room_ids: list[str], columns: list[str], years: float, interval: int
+) -> dict[str, pd.DataFrame]:
+    """Return random samples for every room, like trend.fetch_rooms() does.
+
+    Args:
+        room_ids: rooms to create samples for
+        columns: numeric columns of the samples
+        years: number of years of samples
+        interval: seconds between samples
+
+    Returns:
+        dict with a DataFrame per room_id, indexed by localised sample time
+    """
+    rng = np.random.default_rng(42)
+    end = int(time.time())
+    n_samples = int(years * 365 * 86400 / interval)
+    rooms = {}
+    for room_id in room_ids:
+        # jitter the sample times, so every room has its own timeline
+        epochs = end - np.arange(n_samples)[::-1] * interval - rng.integers(0, interval // 2)
+        index = pd.to_datetime(epochs, unit="s", utc=True).tz_convert("Europe/Amsterdam")
+        rooms[room_id] = pd.DataFrame(
+            {_c: rng.integers(0, 40, n_samples).astype(float) for _c in columns}, index=index
+        )
+    return rooms
+
+
+def legacy(rooms: dict, aggregation: str, columns: list[str]) -> dict:
+    """Return the layout of `trend.pivot_rooms()` made the way trend.py used to.
+
+    Every room is resampled and then outer-merged, per column, with the rooms
+    before it.
+    """
+    data_dict: dict = {_c: None for _c in columns}
+    for room_id, df in rooms.items():
+        df = df.resample(aggregation).mean(numeric_only=True).interpolate()
+        for column, prev_df in data_dict.items():
+            df_column = df[[column]].rename(columns={column: room_id})
+            if prev_df is not None:
+                df_column = pd.merge(
+                    prev_df, df_column, left_index=True, right_index=True, how="outer"
+                )
+            data_dict[column] = df_column
+    if "cmp_freq" in data_dict:
+        # the compressor graph used a row-wise maximum
+        data_dict["cmp_freq"] = data_dict["cmp_freq"].apply(np.max, axis=1)
+    return data_dict
+
+
+def vectorised(
+    pivot_rooms: Callable[..., dict], rooms: dict, aggregation: str, columns: list[str]
+) -> dict:
+    """Return the layout of `trend.pivot_rooms()`, which is passed as `pivot_rooms`."""
+    data_dict = pivot_rooms(rooms, aggregation, columns)
+    if "cmp_freq" in data_dict:
+        data_dict["cmp_freq"] = data_dict["cmp_freq"].max(axis=1)
+    return data_dict
+
+
+def best_of(repeat: int, func, *args) -> tuple[float, dict]:
+    """Return the fastest time of `repeat` calls of `func` and its result."""
+    timings = []
+    result: dict = {}
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - t0)
+    return min(timings), result
+
+
+def main(workdir: str) -> None:
+    """Run the benchmark.
+
+    Args:
+        workdir: directory for the (empty) database that trend.py needs to import
+    """
+    # point trend.py at an empty database, so no kimnaty database is needed
+    database = os.path.join(workdir, "kimnaty.v2.sqlite3")
+    with contextlib.closing(s3.connect(database)) as con:
+        kimdb.create_schema(con)
+    constants.CONFIG.database = database
+    constants.CONFIG.website = workdir
+    import trend  # pylint: disable=import-outside-toplevel
+
+    tables = {
+        "data": [f"{_i // 3}.{_i % 3 + 1}" for _i in range(OPTION.rooms)],
+        "aircon": [f"airco{_i}" for _i in range(OPTION.aircos)],
+    }
+    for table, room_ids in tables.items():
+        columns = rollup.COLUMNS[table]
+        rooms = synthetic_rooms(room_ids, columns, OPTION.years, OPTION.interval)
+        n_samples = sum(len(_df) for _df in rooms.values())
+        t_old, old = best_of(OPTION.repeat, legacy, rooms, OPTION.aggregation, columns)
+        t_new, new = best_of(
+            OPTION.repeat, vectorised, trend.pivot_rooms, rooms, OPTION.aggregation, columns
+        )
+        for column in columns:
+            pd.testing.assert_index_equal(old[column].index, new[column].index)
+            np.testing.assert_array_equal(old[column].to_numpy(), new[column].to_numpy())
+        print(
+            f"{table:8s} {len(room_ids):3d} rooms {n_samples:9d} samples: "
+            f"merge chain {t_old:7.3f} s, pivot {t_new:7.3f} s, "
+            f"speedup {t_old / t_new:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the layout of the trend data.")
+    parser.add_argument("--years", type=float, default=3, help="years of samples (default: 3)")
+    parser.add_argument("--interval", type=int, default=300, help="seconds between samples")
+    parser.add_argument("--rooms", type=int, default=7, help="number of rooms (default: 7)")
+    parser.add_argument("--aircos", type=int, default=2, help="number of aircos (default: 2)")
+    parser.add_argument("--aggregation", default="h", help="resample to (default: h)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per method (default: 3)")
+    OPTION = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="kimnaty-bench-") as _workdir:
+        main(_workdir)
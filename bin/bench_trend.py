@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+# kimnaty
+# Copyright (C) 2024  Maurice (mausy5043) Hendrix
+# AGPL-3.0-or-later  - see LICENSE
+
+"""Benchmark the stages of trend.py on a synthetic database.
+
+Creates a database with the schema of sq3_kimnaty.sql, filled with rooms that
+are sampled every 2100 s and aircos that are sampled every 120 s, like the
+daemon does. Then times fetching, laying out and rendering the data of the
+hour, day and month trends. The peak memory of every stage is measured in a
+separate run with tracemalloc, so it does not slow down the timed runs, e.g.:
+    python3 bench_trend.py --years 3 --rooms 7 --aircos 2
+    python3 bench_trend.py --database /tmp/kimnaty.v2.sqlite3 --report bench.json
+
+A database given with --database is reused if it exists, so the results of
+code changes can be compared on the same data.
+"""
+
+import argparse
+import json
+import os
+import resource
+import sqlite3 as s3
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from itertools import repeat
+
+import constants
+import kimdb
+import numpy as np
+import pandas as pd
+import rollup
+
+# seconds between samples, as in constants.py
+CYCLE_RHT = 2100
+CYCLE_AC = 120
+TIMEZONE = "Europe/Amsterdam"
+STAGES = ["fetch", "layout", "render"]
+
+
+def sample_times(epochs: np.ndarray) -> list[str]:
+    """Return the local sample_time of every epoch, formatted like the daemon does."""
+    local = pd.to_datetime(epochs, unit="s", utc=True).tz_convert(TIMEZONE)
+    return list(local.strftime(constants.DT_FORMAT))
+
+
+def seasons(epochs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Return the phase of the day and of the year of every epoch in radians."""
+    day = 2 * np.pi * (epochs % 86400) / 86400
+    year = 2 * np.pi * (epochs % 31557600) / 31557600
+    return day, year
+
+
+def create_database(
+    database: str, years: float, room_ids: list[str], airco_ids: list[str]
+) -> None:
+    """Create a database with the kimnaty schema and fill it with synthetic samples.
+
+    Args:
+        database: file to create; an existing file is replaced
+        years: number of years of samples up to now
+        room_ids: rooms to create samples for
+        airco_ids: aircos to create samples for
+    """
+    if os.path.isfile(database):
+        os.remove(database)
+    rng = np.random.default_rng(42)
+    end = int(time.time())
+    start = end - int(years * 365 * 86400)
+    con = s3.connect(database)
+    kimdb.create_schema(con)
+    con.execute("DELETE FROM rooms;")
+    con.executemany(
+        "INSERT INTO rooms (room_id, name, health) VALUES (?, ?, 50);",
+        [(_r, f"room {_r}") for _r in room_ids],
+    )
+    for room_id in room_ids:
+        # the scan of all devices takes a while, so the samples jitter
+        epochs = np.arange(start, end, CYCLE_RHT) + rng.integers(0, 60)
+        epochs = epochs + rng.integers(0, 30, len(epochs))
+        day, year = seasons(epochs)
+        n_samples = len(epochs)
+        temperature = (
+            19.0 + 2.0 * np.sin(day) - 3.0 * np.cos(year) + rng.normal(0, 0.3, n_samples)
+        )
+        humidity = 55.0 + 10.0 * np.sin(day + 1.0) + rng.normal(0, 2.0, n_samples)
+        voltage = 3.1 - 0.4 * (epochs - start) / (end - start) + rng.normal(0, 0.01, n_samples)
+        con.executemany(
+            "INSERT INTO data (sample_time, sample_epoch, room_id, temperature, humidity, voltage)"
+            " VALUES (?, ?, ?, ?, ?, ?);",
+            zip(
+                sample_times(epochs),
+                epochs.tolist(),
+                repeat(room_id),
+                temperature.round(1).tolist(),
+                humidity.round(0).tolist(),
+                voltage.round(3).tolist(),
+                strict=False,
+            ),
+        )
+    for airco_id in airco_ids:
+        epochs = np.arange(start, end, CYCLE_AC) + rng.integers(0, CYCLE_AC)
+        day, year = seasons(epochs)
+        n_samples = len(epochs)
+        outside = 11.0 - 8.0 * np.cos(year) - 4.0 * np.cos(day) + rng.normal(0, 1.0, n_samples)
+        # heating when it is cold and cooling when it is hot outside
+        power = ((outside < 6.0) | (outside > 22.0)).astype(int)
+        mode = np.where(outside < 6.0, 4, 3)
+        target = np.where(mode == 4, 21.0, 24.0)
+        inside = target + 1.5 * np.sin(day) + rng.normal(0, 0.5, n_samples)
+        cmp_freq = np.where(power == 1, rng.integers(10, 80, n_samples), 0)
+        con.executemany(
+            "INSERT INTO aircon (sample_time, sample_epoch, room_id, ac_power, ac_mode,"
+            " temperature_ac, temperature_target, temperature_outside, cmp_freq)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);",
+            zip(
+                sample_times(epochs),
+                epochs.tolist(),
+                repeat(airco_id),
+                power.tolist(),
+                mode.tolist(),
+                inside.round(1).tolist(),
+                target.tolist(),
+                outside.round(1).tolist(),
+                cmp_freq.tolist(),
+                strict=False,
+            ),
+        )
+    con.commit()
+    # the daemon keeps the rollups up to date
+    rollup.catch_up(con)
+    con.close()
+
+
+def run_trend(trend, period: str, hours: int, memory: bool = False) -> dict:
+    """Run the stages of one trend and measure them.
+
+    Args:
+        trend: the imported trend module
+        period: trend to run; a key of trend.GRAPHS
+        hours: number of hours of data to fetch
+        memory: also measure the peak memory of every stage; tracemalloc must be running
+
+    Returns:
+        wall time, CPU time (and peak memory) per stage and the number of rows fetched
+    """
+    stats: dict = {}
+
+    def measure(stage: str, func: Callable, *args):
+        if memory:
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = func(*args)
+        stats[stage] = {
+            "wall": time.perf_counter() - wall,
+            "cpu": time.process_time() - cpu,
+        }
+        if memory:
+            stats[stage]["peak_mib"] = tracemalloc.get_traced_memory()[1] / 1024**2
+        return result
+
+    aggregation = trend.RESOLUTION[period]
+    rollups = period != "hours"
+    rooms_rht, rooms_ac = measure("fetch", trend.fetch_tables, hours, aggregation, False, rollups)
+    data_dict = measure("layout", trend.graph_data, rooms_rht, rooms_ac, aggregation)
+    measure("render", trend.plot_graphs, {period: data_dict})
+    stats["rows"] = sum(len(_df) for _df in [*rooms_rht.values(), *rooms_ac.values()])
+    return stats
+
+
+def main(workdir: str) -> None:
+    """Create the database if needed and run the benchmark.
+
+    Args:
+        workdir: directory for the graphs and, if no --database is given, the database
+    """
+    database = OPTION.database or os.path.join(workdir, "kimnaty.v2.sqlite3")
+    room_ids = [f"{_i // 9}.{_i % 9 + 1}" for _i in range(OPTION.rooms)]
+    airco_ids = [f"airco{_i}" for _i in range(OPTION.aircos)]
+    if not os.path.isfile(database):
+        t0 = time.perf_counter()
+        create_database(database, OPTION.years, room_ids, airco_ids)
+        print(f"Created {database} in {time.perf_counter() - t0:.1f} s")
+    print(f"Database size: {os.path.getsize(database) / 1024**2:.1f} MiB")
+
+    # point trend.py at the synthetic database and keep the graphs out of the website
+    constants.CONFIG.database = database
+    constants.CONFIG.website = workdir
+    import trend  # pylint: disable=import-outside-toplevel
+
+    trend.DEVICE_LIST = [{"room_id": _r} for _r in room_ids]
+    trend.AIRCO_LIST = [{"name": _a} for _a in airco_ids]
+    hours = {
+        "hours": constants.TREND["option_hours"],
+        "days": constants.TREND["option_days"] * 24,
+        "months": constants.TREND["option_months"] * 31 * 24,
+    }
+
+    report: dict = {"database": database, "trends": {}}
+    for period, hours_to_fetch in hours.items():
+        runs = [run_trend(trend, period, hours_to_fetch) for _ in range(OPTION.repeat)]
+        best = {_s: min((_r[_s] for _r in runs), key=lambda _t: _t["wall"]) for _s in STAGES}
+        tracemalloc.start()
+        peaks = run_trend(trend, period, hours_to_fetch, memory=True)
+        tracemalloc.stop()
+        for stage in STAGES:
+            best[stage]["peak_mib"] = peaks[stage]["peak_mib"]
+        report["trends"][period] = {"hours": hours_to_fetch, "rows": runs[0]["rows"], **best}
+    report["maxrss_mib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    report["maxrss_children_mib"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    print(f"{'trend':8s} {'stage':8s} {'wall [s]':>9s} {'cpu [s]':>9s} {'peak [MiB]':>11s}")
+    for period, result in report["trends"].items():
+        for stage in STAGES:
+            print(
+                f"{period:8s} {stage:8s} {result[stage]['wall']:9.3f}"
+                f" {result[stage]['cpu']:9.3f} {result[stage]['peak_mib']:11.1f}"
+            )
+        print(f"{period:8s} {result['rows']:d} rows for {result['hours']} hours")
+    print(
+        f"max. RSS {report['maxrss_mib']:.1f} MiB;"
+        f" render processes {report['maxrss_children_mib']:.1f} MiB"
+    )
+    if OPTION.report:
+        with open(OPTION.report, "w", encoding="utf-8") as _f:
+            json.dump(report, _f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark trend.py on synthetic data.")
+    parser.add_argument("--database", help="database to use; created if it does not exist")
+    parser.add_argument("--years", type=float, default=3, help="years of samples (default: 3)")
+    parser.add_argument("--rooms", type=int, default=7, help="number of rooms (default: 7)")
+    parser.add_argument("--aircos", type=int, default=2, help="number of aircos (default: 2)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per trend (default: 3)")
+    parser.add_argument("--report", help="also write the results to this JSON file")
+    OPTION = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="kimnaty-bench-") as _workdir:
+        main(_workdir)
@@ -1,5 +1,13 @@
 #!/usr/bin/env python3
 
+"""Settings of kimnaty.
+
+Settings that need the filesystem or the database (the location of the
+database, the website and the contents of the `rooms` table) are determined
+on first access and cached. Importing this module has no side-effects.
+"""
+
+import functools
 import json
 import os
 import pprint as pp
@@ -7,50 +15,30 @@ import sqlite3 as s3
 import subprocess  # nosec B404
 import sys
 import time
+from collections.abc import Callable
 from typing import Any
 
-import pandas as pd
-import sh  # type: ignore[import-untyped]
-from pandas.errors import DatabaseError
-from sh import CommandNotFound
-
 # fmt: off
 # define paths
 _MYHOME = os.environ["HOME"]
 _DATABASE_FILENAME = "kimnaty.v2.sqlite3"
-_DATABASE: str = f"/srv/rmt/_databases/kimnaty/{_DATABASE_FILENAME}"
+# locations where the database is searched for; in order of preference
+_DATABASE_PATHS: list[str] = [
+    f"/srv/rmt/_databases/kimnaty/{_DATABASE_FILENAME}",
+    f"/srv/databases/{_DATABASE_FILENAME}",
+    f"/srv/data/{_DATABASE_FILENAME}",
+    f"/mnt/data/{_DATABASE_FILENAME}",
+    f".local/{_DATABASE_FILENAME}",
+    f"{_MYHOME}/.sqlite3/kimnaty/{_DATABASE_FILENAME}",
+]
 __HERE: list[str] = os.path.realpath(__file__).split("/")
 # example: HERE = ['', 'home', 'pi', 'kimnaty', 'bin', 'constants.py']
 _HERE: str = "/".join(__HERE[0:-2])
 _OPTION_OVERRIDE_FILE = f"{_MYHOME}/.config/kimnaty.json"
 _WEBSITE = "/run/kimnaty/site/img"
 
-if not os.path.isfile(_DATABASE):
-    _DATABASE = f"/srv/databases/{_DATABASE_FILENAME}"
-if not os.path.isfile(_DATABASE):
-    _DATABASE = f"/srv/data/{_DATABASE_FILENAME}"
-if not os.path.isfile(_DATABASE):
-    _DATABASE = f"/mnt/data/{_DATABASE_FILENAME}"
-if not os.path.isfile(_DATABASE):
-    _DATABASE = f".local/{_DATABASE_FILENAME}"
-    print(f"Searching for {_DATABASE}")
-if not os.path.isfile(_DATABASE):
-    _DATABASE = f"{_MYHOME}/.sqlite3/kimnaty/{_DATABASE_FILENAME}"
-    print(f"Searching for {_DATABASE}")
-if not os.path.isfile(_DATABASE):
-    print("Database is missing.")
-    # _DATABASE_FILENAME = "unknown"
-    # _DATABASE = None
-    sys.exit(1)
-
-if not os.path.isdir(_WEBSITE):
-    print("Graphics will be diverted to /tmp")
-    _WEBSITE = "/tmp"   # nosec B108
-
 DT_FORMAT = "%Y-%m-%d %H:%M:%S"
 
-ROOMS = {}
-BAT_HEALTH = {}
 OPTION_OVERRIDE = {}
 
 if os.path.isfile(_OPTION_OVERRIDE_FILE):
@@ -61,21 +49,71 @@ if os.path.isfile(_OPTION_OVERRIDE_FILE):
         # 3. CLI OPTION setting
         OPTION_OVERRIDE = json.load(j, parse_float=float, parse_int=int)
 
+
+class _Config:
+    """Settings that are expensive to determine; resolved on first access and cached."""
+
+    @functools.cached_property
+    def database(self) -> str:
+        """Return the path to the database; exit if there is none."""
+        for _idx, _database in enumerate(_DATABASE_PATHS):
+            if _idx >= 4:
+                print(f"Searching for {_database}")
+            if os.path.isfile(_database):
+                return _database
+        print("Database is missing.")
+        sys.exit(1)
+
+    @functools.cached_property
+    def website(self) -> str:
+        """Return the directory to store the graphics in."""
+        if not os.path.isdir(_WEBSITE):
+            print("Graphics will be diverted to /tmp")
+            return "/tmp"   # nosec B108
+        return _WEBSITE
+
+    @functools.cached_property
+    def rooms_table(self) -> dict[str, dict[str, Any]]:
+        """Return the contents of the `rooms` table as {column: {room_id: value}}."""
+        _rows = _read_rooms(self.database)
+        return {
+            "name": {_room_id: _name for _room_id, _name, _ in _rows},
+            "health": {_room_id: _health for _room_id, _, _health in _rows},
+        }
+
+    @property
+    def rooms(self) -> dict[str, str]:
+        return self.rooms_table["name"]
+
+    @property
+    def bat_health(self) -> dict[str, int]:
+        return self.rooms_table["health"]
+
+
+CONFIG = _Config()
+
+
 # The paths defined here must match the paths defined in include.sh
 # $website_dir  and  $website_image_dir
-TREND = {
-    "database": _DATABASE,
-    "sql_table_rht": "data",
-    "sql_table_ac": "aircon",
-    "website": _WEBSITE,
-    "day_graph": f"{_WEBSITE}/kim_hours",
-    "month_graph": f"{_WEBSITE}/kim_days",
-    "year_graph": f"{_WEBSITE}/kim_months",
-    "option_hours": OPTION_OVERRIDE.get('trend', {}).get('hours', 84),  # 3.5 days
-    "option_days": OPTION_OVERRIDE.get('trend', {}).get('days', 77),  # 2.5 months
-    "option_months": OPTION_OVERRIDE.get('trend', {}).get('months', 38),  # 3 years & 2 months
-    "option_outside": OPTION_OVERRIDE.get('trend', {}).get('outside', False),
-}
+def _trend() -> dict[str, Any]:
+    return {
+        "database": CONFIG.database,
+        "sql_table_rht": "data",
+        "sql_table_ac": "aircon",
+        "website": CONFIG.website,
+        # samples of the last graph are kept here to speed up the next run
+        "cache_dir": f"{_MYHOME}/.cache/kimnaty",
+        "day_graph": f"{CONFIG.website}/kim_hours",
+        "month_graph": f"{CONFIG.website}/kim_days",
+        "year_graph": f"{CONFIG.website}/kim_months",
+        # processes that render the graphs in parallel
+        "max_workers": os.cpu_count() or 1,
+        "option_hours": OPTION_OVERRIDE.get('trend', {}).get('hours', 84),  # 3.5 days
+        "option_days": OPTION_OVERRIDE.get('trend', {}).get('days', 77),  # 2.5 months
+        "option_months": OPTION_OVERRIDE.get('trend', {}).get('months', 38),  # 3 years & 2 months
+        "option_outside": OPTION_OVERRIDE.get('trend', {}).get('outside', False),
+    }
+
 
 DEVICES: list[dict[str, str]] = [
     {"mac": "A4:C1:38:59:9A:9B", "room_id": "0.1", "name": "woonkamer"},
@@ -100,24 +138,33 @@ _sample_time_lyws = _sample_time_lyw * len(DEVICES) * 2
 # high loads and battery drain.
 _cycle_time = 2100.0
 
-KIMNATY = {
-    "database": _DATABASE,
-    "sql_command": (
-        "INSERT INTO data ("
-        "sample_time, sample_epoch, "
-        "room_id, "
-        "temperature, humidity, voltage "
-        ") "
-        "VALUES (?, ?, ?, ?, ?, ?)"
-    ),
-    "sql_table": "data",
-    "cycle_time": _cycle_time,
-    "aggregate": "raw",
-}
+
+def _kimnaty() -> dict[str, Any]:
+    return {
+        "database": CONFIG.database,
+        "sql_command": (
+            "INSERT INTO data ("
+            "sample_time, sample_epoch, "
+            "room_id, "
+            "temperature, humidity, voltage "
+            ") "
+            "VALUES (:sample_time, :sample_epoch, :room_id, :temperature, :humidity, :voltage)"
+        ),
+        "sql_table": "data",
+        "cycle_time": _cycle_time,
+        # Spread the reads of the devices evenly over the cycle instead of
+        # reading all devices in one burst.
+        "stagger": OPTION_OVERRIDE.get('daemon', {}).get('stagger', False),
+        # Maximum time to wait for the BT adapter to be free before skipping a
+        # device; a read that takes longer is logged but not interrupted.
+        "read_timeout": _sample_time_lyw * 2,
+        "aggregate": "raw",
+    }
+
 
 AIRCO: list[dict[str, Any]] = [
-    {"name": "airco0", "ip": "192.168.2.30", "device": None},
-    {"name": "airco1", "ip": "192.168.2.31", "device": None},
+    {"name": "airco0", "ip": "192.168.2.30", "device": None, "retry_at": 0.0},
+    {"name": "airco1", "ip": "192.168.2.31", "device": None, "retry_at": 0.0},
 ]
 
 # Also the aircos are read. Reading those takes on average 2 sec/AC.
@@ -126,52 +173,126 @@ _sample_time_ac = 5.0
 _sample_time_acs = _sample_time_ac * len(AIRCO)
 # Set a minimum pause time between scans
 _cycle_time_ac = 120.0
+# A unit that fails to respond is tried once more after this many seconds.
+_retry_delay_ac = 13.0
+
+
+def _ac() -> dict[str, Any]:
+    return {
+        "database": CONFIG.database,
+        "sql_command": (
+            "INSERT INTO aircon ("
+            "sample_time, sample_epoch, "
+            "room_id, "
+            "ac_power, ac_mode,"
+            "temperature_ac, temperature_target, temperature_outside, "
+            "cmp_freq) "
+            "VALUES (:sample_time, :sample_epoch, :room_id, :ac_power, :ac_mode, "
+            ":temperature_ac, :temperature_target, :temperature_outside, :cmp_freq)"
+        ),
+        "sql_table": "aircon",
+        "cycle_time": _cycle_time_ac,
+        "retry_delay": _retry_delay_ac,
+        "max_workers": len(AIRCO),
+        "aggregate": "avg",
+    }
+
+
+# Samples that can not be stored in the database are kept here until the
+# database is available again.
+SPOOL = {
+    "directory": f"{_MYHOME}/.local/state/kimnaty/spool",
+}
 
-AC = {
-    "database": _DATABASE,
-    "sql_command": (
-        "INSERT INTO aircon ("
-        "sample_time, sample_epoch, "
-        "room_id, "
-        "ac_power, ac_mode,"
-        "temperature_ac, temperature_target, temperature_outside, "
-        "cmp_freq) "
-        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
-    ),
-    "sql_table": "aircon",
-    "cycle_time": _cycle_time_ac,
-    "aggregate": "avg",
+# The daemon stores the queued samples every `flush_time` seconds and the
+# devices' health every `health_time` seconds. The hourly and daily rollups
+# of the samples are brought up to date every `rollup_time` seconds.
+# Statistics of how well the daemon keeps to its schedule are logged every
+# `report_time` seconds.
+# The metrics of the daemon are served on http://127.0.0.1:`metrics_port`/metrics
+# in the Prometheus text format; set the port to 0 to disable this.
+DAEMON = {
+    "flush_time": 60.0,
+    "health_time": 300.0,
+    "rollup_time": 900.0,
+    "report_time": 3600.0,
+    "metrics_port": OPTION_OVERRIDE.get('daemon', {}).get('metrics_port', 9150),
+    "retention_time": 86400.0,
 }
 
-# Example: UPDATE rooms SET health=40 WHERE room_id=0.1;
-HEALTH_UPDATE = {
-    "database": _DATABASE,
-    "sql_command": "INSERT INTO rooms (room_id, name, health) VALUES (?, ?, ?)",
-    "sql_table": "rooms",
+# Raw samples older than `raw_days` (per table; 0 keeps all) are deleted once the
+# hourly and daily rollups hold them; see retention.py. They are deleted
+# `batch_rows` at a time with a pause of `batch_pause` seconds in between. Free
+# pages are given back to the filesystem `vacuum_pages` at a time.
+RETENTION: dict[str, Any] = {
+    "raw_days": {
+        "data": OPTION_OVERRIDE.get('retention', {}).get('data', 3660),
+        "aircon": OPTION_OVERRIDE.get('retention', {}).get('aircon', 3660),
+    },
+    "batch_rows": 5000,
+    "batch_pause": 0.2,
+    "vacuum_pages": 1024,
 }
 
-_health_query = "SELECT * FROM rooms;"
+# The data API (trendapi.py) listens on `host`:`port` and returns at most
+# `max_points` datapoints per series; longer periods are averaged to fit.
+API = {
+    "host": OPTION_OVERRIDE.get('api', {}).get('host', "127.0.0.1"),
+    "port": OPTION_OVERRIDE.get('api', {}).get('port', 9151),
+    "max_points": OPTION_OVERRIDE.get('api', {}).get('max_points', 2000),
+    "default_points": 1000,
+}
 
+# Example: UPDATE rooms SET health=40 WHERE room_id=0.1;
+def _health_update() -> dict[str, Any]:
+    return {
+        "database": CONFIG.database,
+        "sql_command": (
+            "INSERT INTO rooms (room_id, name, health) VALUES (?, ?, ?) "
+            "ON CONFLICT(room_id) DO UPDATE SET name = excluded.name, health = excluded.health"
+        ),
+        "sql_query": _health_query,
+        "sql_table": "rooms",
+    }
+
+
+_health_query = "SELECT room_id, name, health FROM rooms;"
+
+# settings that are built on first access; see __getattr__()
+_LAZY: dict[str, Callable[[], Any]] = {
+    "TREND": _trend,
+    "KIMNATY": _kimnaty,
+    "AC": _ac,
+    "HEALTH_UPDATE": _health_update,
+    "ROOMS": lambda: CONFIG.rooms,
+    "BAT_HEALTH": lambda: CONFIG.bat_health,
+}
 
-def get_health(room_id: str) -> int:
-    _health: int = 0
-    locked = True
-    _table_data: dict = {}
-    while locked:
-        try:
-            with s3.connect(_DATABASE) as conn:
-                _table_data = pd.read_sql_query(_health_query, conn, index_col="room_id").to_dict()
-                locked = False
-        except DatabaseError:
-            locked = True
-            # wait for the database to become unlocked
-            time.sleep(12.3)
+
+def __getattr__(name: str) -> Any:
+    """Build the settings in _LAZY on first access (PEP 562) and cache them."""
     try:
-        _health = _table_data["health"][room_id]
+        _builder = _LAZY[name]
     except KeyError:
-        print(f"*** KeyError when retrieving health for room {room_id}")
-        print(_table_data)
-    return _health
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    _value = _builder()
+    globals()[name] = _value
+    return _value
+
+
+def _read_rooms(database: str) -> list[tuple[str, str, int]]:
+    """Return (room_id, name, health) of all rooms; wait while the database is locked."""
+    while True:
+        try:
+            _con = s3.connect(database)
+            try:
+                return [(str(_r), _n, _h) for _r, _n, _h in _con.execute(_health_query)]
+            finally:
+                _con.close()
+        except s3.OperationalError:
+            # database is locked
+            # print("database is locked; waiting...")
+            time.sleep(10.0)
 
 
 def get_app_version() -> str:
@@ -180,6 +301,10 @@ def get_app_version() -> str:
     Returns:
         versionstring
     """
+    # sh is only needed here; keep it out of the import of this module
+    import sh  # type: ignore[import-untyped]  # pylint: disable=C0415
+    from sh import CommandNotFound  # pylint: disable=C0415
+
     # git log -n1 --format="%h"
     # git --no-pager log -1 --format="%ai"
     # git log -n1 --format="%h"
@@ -196,6 +321,9 @@ def get_app_version() -> str:
 
 
 def get_pypkg_version(package: str) -> str:
+    import sh  # type: ignore[import-untyped]  # pylint: disable=C0415
+    from sh import CommandNotFound  # pylint: disable=C0415
+
     # pip list | grep bluepy3
     args = ["list"]
     try:
@@ -212,6 +340,9 @@ def get_pypkg_version(package: str) -> str:
 
 
 def get_btctl_version() -> str:
+    import sh  # type: ignore[import-untyped]  # pylint: disable=C0415
+    from sh import CommandNotFound  # pylint: disable=C0415
+
     # bluetoothctl version
     args = ["version"]
     try:
@@ -223,6 +354,8 @@ def get_btctl_version() -> str:
 
 
 def get_helper_version() -> str:
+    from sh import CommandNotFound  # type: ignore[import-untyped]  # pylint: disable=C0415
+
     wait_string = "Please wait while searching for helper..."
     _exit_code = "not installed"
     print(wait_string, end="\r")
@@ -258,44 +391,16 @@ def find_all(name: str, path: str) -> list[str]:
     return result
 
 
-if _DATABASE:
-    _locked = True
-    while _locked:
-        with s3.connect(_DATABASE) as _con:
-            try:
-                _ROOMS_TBL = pd.read_sql_query(_health_query, _con, index_col="room_id").to_dict()
-                _locked = False
-                try:
-                    ROOMS = _ROOMS_TBL["name"]
-                except KeyError:
-                    print("*** KeyError when retrieving ROOMS")
-                    print(_ROOMS_TBL)
-                    raise
-                try:
-                    BAT_HEALTH = _ROOMS_TBL["health"]
-                except KeyError:
-                    print("*** KeyError when retrieving BAT_HEALTH")
-                    print(_ROOMS_TBL)
-                    raise
-            except DatabaseError:
-                # database is locked
-                # print("database is locked; waiting...")
-                time.sleep(10.0)
-
-
-# fmt: on
-
-
 if __name__ == "__main__":
     print("")
     print(f"home              = {_MYHOME}")
-    print(f"database location = {_DATABASE}")
+    print(f"database location = {CONFIG.database}")
     print(f"devices           =\n{pp.pformat(DEVICES, indent=10)}")
-    print(f"rooms (DB)        =\n{pp.pformat(ROOMS, indent=20)}")
-    print(f"battery health    =\n{pp.pformat(BAT_HEALTH, indent=20)}")
+    print(f"rooms (DB)        =\n{pp.pformat(CONFIG.rooms, indent=20)}")
+    print(f"battery health    =\n{pp.pformat(CONFIG.bat_health, indent=20)}")
     print("")
     print(f"user options      =\n{pp.pformat(OPTION_OVERRIDE, indent=10, width=1)}")
-    print(f"trend options     =\n{pp.pformat(TREND, indent=10, width=1)}")
+    print(f"trend options     =\n{pp.pformat(_trend(), indent=10, width=1)}")
     print("")
     print(f"bluetoothctl      = {get_btctl_version()}")
     print(f"bluepy3-helper    = {get_helper_version()}")
@@ -32,7 +32,8 @@ declare -a kimnaty_timers=("kimnaty.trend.day.timer"
         "kimnaty.trend.year.timer")
         # "kimnaty.update.timer" (incl. the .service) is not installed
 # list of services provided
-declare -a kimnaty_services=("kimnaty.kimnaty.service" "kimnaty.bluepy3-helper-killer.service")
+declare -a kimnaty_services=("kimnaty.kimnaty.service" "kimnaty.bluepy3-helper-killer.service"
+        "kimnaty.api.service")
 
 # Install python3 and develop packages
 # Support for matplotlib & numpy needs to be installed seperately
@@ -106,12 +107,15 @@ graph_kimnaty() {
     echo "*** $app_name running on $host_name >>>>>>: graph $1"
     ROOT_DIR=$1
 
-    echo "Creating graphs [1]"
-    . "${ROOT_DIR}/bin/pastday.sh"
-    echo "Creating graphs [2]"
-    . "${ROOT_DIR}/bin/pastmonth.sh"
-    echo "Creating graphs [3]"
-    . "${ROOT_DIR}/bin/pastyear.sh"
+    echo "Creating graphs"
+    # one pass over the data for the day, month and year graphs
+    pushd "${ROOT_DIR}/bin" >/dev/null || exit 1
+        # shellcheck disable=SC2154
+        if [ ! -d "${website_image_dir}" ]; then
+            boot_kimnaty
+        fi
+        ./trend.py --all
+    popd >/dev/null || exit
 }
 
 # stop, update the repo and start the application
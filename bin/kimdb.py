@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+# kimnaty
+# Copyright (C) 2024  Maurice (mausy5043) Hendrix
+# AGPL-3.0-or-later  - see LICENSE
+
+"""Database helpers for the kimnaty daemon."""
+
+import contextlib
+import logging
+import os
+import sqlite3 as s3
+import threading
+import time
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sq3_kimnaty.sql")
+
+
+def create_schema(con: s3.Connection) -> None:
+    """Create the tables of sq3_kimnaty.sql in the database of `con`."""
+    with open(SCHEMA, encoding="utf-8") as _f:
+        # skip the shebang
+        con.executescript("".join(_l for _l in _f if not _l.startswith("#!")))
+
+
+class Database:
+    """One long-lived connection to the database, shared by all threads of the daemon.
+
+    The database is put in WAL mode, so readers (e.g. trend.py) do not block the
+    daemon and the daemon does not block the readers.
+    """
+
+    def __init__(
+        self, database: str, busy_timeout: float = 10.0, journal_size_limit: int = 8 * 1024**2
+    ) -> None:
+        """Initialise the connection object. The connection is opened when first used.
+
+        Args:
+            database: path to the database file; it must exist
+            busy_timeout: seconds to wait for a lock held by another process
+            journal_size_limit: bytes of WAL file to keep after a checkpoint
+        """
+        self.database: str = database
+        self.busy_timeout: float = busy_timeout
+        self.journal_size_limit: int = journal_size_limit
+        self._con: s3.Connection | None = None
+        self._lock = threading.RLock()
+        self.stats: dict[str, float] = {
+            "transactions": 0,
+            "lock_waits": 0,
+            "lock_wait_time": 0.0,
+        }
+
+    def _connect(self) -> s3.Connection:
+        # mode=rw: never create an empty database when the file is missing
+        con = s3.connect(
+            f"file:{self.database}?mode=rw",
+            uri=True,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+        )
+        con.execute("PRAGMA journal_mode=WAL;")
+        con.execute("PRAGMA synchronous=NORMAL;")
+        con.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)};")
+        con.execute(f"PRAGMA journal_size_limit={self.journal_size_limit};")
+        LOGGER.info(f"Connected to {self.database} (SQLite {s3.sqlite_version})")
+        return con
+
+    def execute(self, action, retries: int = 2):
+        """Run `action(connection)` in a single transaction.
+
+        Args:
+            action: callable that receives the connection
+            retries: number of times to retry while the database is locked
+
+        Returns:
+            whatever `action` returns
+        """
+        with self._lock:
+            while True:
+                t0 = time.time()
+                try:
+                    if self._con is None:
+                        self._con = self._connect()
+                    with self._con:
+                        result = action(self._con)
+                    self.stats["transactions"] += 1
+                    return result
+                except s3.OperationalError as her:
+                    if "locked" not in str(her) and "busy" not in str(her):
+                        # e.g. the file went missing; start afresh next time
+                        self.close()
+                        raise
+                    self.stats["lock_waits"] += 1
+                    self.stats["lock_wait_time"] += time.time() - t0
+                    if retries <= 0:
+                        raise
+                    retries -= 1
+
+    def close(self) -> None:
+        """Checkpoint the WAL into the database file and close the connection."""
+        with self._lock:
+            if self._con is None:
+                return
+            with contextlib.suppress(s3.Error):
+                self._con.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+            with contextlib.suppress(s3.Error):
+                self._con.close()
+            self._con = None
+
+    def log_stats(self) -> None:
+        """Log the transaction and lock statistics."""
+        LOGGER.info(
+            f"database: {self.stats['transactions']:.0f} transactions; "
+            f"{self.stats['lock_waits']:.0f} lock waits ({self.stats['lock_wait_time']:.1f}s)"
+        )
+
+
+class Table:
+    """Queue of records for one table; stored in bulk by `insert()`."""
+
+    def __init__(self, db: Database, table: str, sql_command: str) -> None:
+        """Initialise the queue.
+
+        Args:
+            db: the shared database connection
+            table: name of the table
+            sql_command: INSERT statement with named parameters matching the record keys
+        """
+        self.db: Database = db
+        self.table: str = table
+        self.sql_command: str = sql_command
+        self.dataq: list[dict] = []
+
+    def queue(self, data: dict) -> None:
+        """Append a record to the queue."""
+        self.dataq.append(data)
+        LOGGER.debug(f"Queued : {data}")
+
+    def insert(self) -> None:
+        """Store all queued records in one transaction.
+
+        Records that could not be stored remain in the queue.
+        """
+        rows = self.dataq[:]
+        if not rows:
+            return
+        self.db.execute(lambda con: con.executemany(self.sql_command, rows))
+        # records queued while inserting stay in the queue
+        del self.dataq[: len(rows)]
+        LOGGER.debug(f"Inserted {len(rows)} records into {self.table}")
+
+
+class RoomHealth:
+    """Keep the name and health of the rooms in memory.
+
+    The `rooms` table is read once. Changes are kept in memory and written
+    back in one batch by `flush()`.
+    """
+
+    def __init__(self, db: Database, sql_query: str, sql_command: str) -> None:
+        """Initialise the cache.
+
+        Args:
+            db: the shared database connection
+            sql_query: query that returns (room_id, name, health) for all rooms
+            sql_command: upsert of (room_id, name, health) into the rooms table
+        """
+        self.db: Database = db
+        self.sql_query: str = sql_query
+        self.sql_command: str = sql_command
+        self._lock = threading.Lock()
+        self._rooms: dict[str, dict] = {}
+        self._dirty: set[str] = set()
+        self.stats: dict[str, float] = {
+            "hits": 0,
+            "misses": 0,
+            "rows_written": 0,
+        }
+
+    def load(self) -> None:
+        """Read the names and health of all rooms from the database."""
+        rows = self.db.execute(lambda con: con.execute(self.sql_query).fetchall())
+        with self._lock:
+            for room_id, name, health in rows:
+                self._rooms[str(room_id)] = {"name": name, "health": health}
+        LOGGER.info(f"Loaded {len(rows)} rooms from the database")
+
+    def health(self, room_id: str) -> int:
+        """Return the last known health of a room (0 if the room is unknown)."""
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                self.stats["misses"] += 1
+                return 0
+            self.stats["hits"] += 1
+            return int(room["health"])
+
+    def update(self, room_id: str, health: int, name: str = "") -> None:
+        """Record the health of a room; it is stored by the next `flush()`.
+
+        Args:
+            room_id: id of the room
+            health: new health of the room
+            name: name to use if the room is not yet known
+        """
+        with self._lock:
+            room = self._rooms.setdefault(room_id, {"name": name or room_id, "health": None})
+            if room["health"] != health:
+                room["health"] = health
+                self._dirty.add(room_id)
+
+    def flush(self) -> None:
+        """Write all changed rooms to the database in one transaction."""
+        with self._lock:
+            rows = [
+                (room_id, self._rooms[room_id]["name"], self._rooms[room_id]["health"])
+                for room_id in sorted(self._dirty)
+            ]
+            self._dirty.clear()
+        if not rows:
+            return
+        try:
+            self.db.execute(lambda con: con.executemany(self.sql_command, rows))
+        except s3.Error:
+            # keep the changes for the next attempt
+            with self._lock:
+                self._dirty.update(row[0] for row in rows)
+            raise
+        self.stats["rows_written"] += len(rows)
+        LOGGER.debug(f"Stored health of {len(rows)} rooms")
+
+    def log_stats(self) -> None:
+        """Log the cache statistics."""
+        LOGGER.info(
+            f"room health: {self.stats['hits']:.0f} hits, {self.stats['misses']:.0f} misses, "
+            f"{self.stats['rows_written']:.0f} rows written"
+        )
@@ -11,23 +11,33 @@ Store data from the devices in an sqlite3 database.
 """
 
 import argparse
+import concurrent.futures
 import contextlib
 import datetime as dt
+import functools
 import logging
 import logging.handlers
 import os
+import resource
 import shutil
+import signal
 import sys
 import syslog
+import threading
 import time
 import traceback
 
 import constants
 import GracefulKiller as gk  # type: ignore[import-untyped]
+import kimdb
 import libdaikin
-import mausy5043_common.libsqlite3 as m3
-import numpy as np
+import metrics
 import pylywsdxx as pyly  # noqa  # type: ignore[import-untyped]
+import queries
+import retention
+import rollup
+import scheduler
+import spool
 
 logging.basicConfig(
     level=logging.INFO,
@@ -59,40 +69,98 @@ MYAPP = HERE[-3]  # kimnaty
 MYROOT = "/".join(HERE[0:-3])  # /home/pi
 APPROOT = "/".join(HERE[0:-2])  # /home/pi/kimnaty
 NODE = os.uname()[1]  # rbair
+# the collector should never need these; they belong to the trending side
+HEAVY_MODULES = ["matplotlib", "numpy", "pandas"]
+ROOM_NAMES = {_dev["room_id"]: _dev["name"] for _dev in constants.DEVICES}
 # fmt: on
 
-sql_health = m3.SqlDatabase(
-    database=constants.HEALTH_UPDATE["database"],
-    table=constants.HEALTH_UPDATE["sql_table"],
-    insert=constants.HEALTH_UPDATE["sql_command"],
-    debug=OPTION.debug,
+sample_spool = spool.Spool(constants.SPOOL["directory"])
+# one connection to the database is shared by all tasks of the daemon
+database = kimdb.Database(constants.KIMNATY["database"])
+room_health = kimdb.RoomHealth(
+    db=database,
+    sql_query=constants.HEALTH_UPDATE["sql_query"],
+    sql_command=constants.HEALTH_UPDATE["sql_command"],
 )
 
+# metrics of the daemon; served by metrics.Server
+METRICS = metrics.Registry()
+# fmt: off
+METRIC_TASK_SECONDS = METRICS.histogram(
+    "kimnaty_task_duration_seconds", "Duration of the runs of a task.", ("task",))
+METRIC_TASK_DRIFT = METRICS.histogram(
+    "kimnaty_schedule_drift_seconds", "How late the runs of a task were started.", ("task",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0))
+METRIC_TASK_SKIPPED = METRICS.counter(
+    "kimnaty_task_skipped_runs_total", "Runs skipped because the previous run had not finished.",
+    ("task",))
+METRIC_BLE_SECONDS = METRICS.histogram(
+    "kimnaty_ble_read_seconds", "Duration of reading a BT device.", ("room",))
+METRIC_BLE_QOS = METRICS.gauge(
+    "kimnaty_ble_qos", "Last reported QoS of a BT device (0...100).", ("room",))
+METRIC_AC_SECONDS = METRICS.histogram(
+    "kimnaty_ac_request_seconds", "Duration of reading an AC device.", ("airco",))
+METRIC_AC_FAILURES = METRICS.counter(
+    "kimnaty_ac_failures_total", "Reads of an AC device that failed.", ("airco",))
+METRIC_DB_SECONDS = METRICS.histogram(
+    "kimnaty_db_insert_seconds", "Duration of storing the queued records of a table.",
+    ("table",))
+METRIC_DB_FAILURES = METRICS.counter(
+    "kimnaty_db_insert_failures_total", "Inserts that failed and were spooled.", ("table",))
+METRIC_QUEUED = METRICS.gauge(
+    "kimnaty_queued_records", "Records waiting in memory to be stored.", ("table",))
+METRIC_SPOOLED = METRICS.gauge(
+    "kimnaty_spooled_records", "Records waiting in the spool to be stored.", ("table",))
+# fmt: on
+
 
-def main() -> None:  # noqa: C901
+def main() -> None:
     """Execute main loop."""
     LOGGER.info(f"Running on Python {sys.version}")
-    killer = gk.GracefulKiller()
+    LOGGER.info(f"Imports and initialisation took {process_age():.2f} s")
+    log_footprint()
+    schedule = scheduler.Scheduler(on_run=record_run, on_skip=record_skip)
+    killer = gk.GracefulKiller(shutdown_handler=schedule.stop)
+
+    def _on_signal(signum, frame) -> None:  # pylint: disable=W0613
+        # wake up the scheduler immediately instead of at the next deadline
+        killer.kill()
+        killer.shutdown()
+
+    for _sig in (signal.SIGTERM, signal.SIGHUP, signal.SIGINT):
+        signal.signal(_sig, _on_signal)
+
+    room_health.load()
+    # the trend queries rely on the composite (room_id, sample_epoch) indexes
+    database.execute(queries.ensure_indexes)
 
     # create an object for the database table for BT devices
-    sql_db_rht = m3.SqlDatabase(
-        database=constants.KIMNATY["database"],  # type: ignore
-        table=constants.KIMNATY["sql_table"],  # type: ignore
-        insert=constants.KIMNATY["sql_command"],  # type: ignore
-        debug=DEBUG,
+    sql_db_rht = kimdb.Table(
+        database,
+        table=constants.KIMNATY["sql_table"],
+        sql_command=constants.KIMNATY["sql_command"],
     )
 
     # create an object for the database table for AC devices
-    sql_db_ac = m3.SqlDatabase(
-        database=constants.AC["database"],  # type: ignore
-        table=constants.AC["sql_table"],  # type: ignore
-        insert=constants.AC["sql_command"],  # type: ignore
-        debug=DEBUG,
+    sql_db_ac = kimdb.Table(
+        database,
+        table=constants.AC["sql_table"],
+        sql_command=constants.AC["sql_command"],
     )
 
+    def _collect() -> None:
+        # read when the metrics are scraped; the tasks don't have to keep these up to date
+        for sql_db in (sql_db_rht, sql_db_ac):
+            METRIC_QUEUED.set(len(sql_db.dataq), table=sql_db.table)
+            METRIC_SPOOLED.set(sample_spool.pending(sql_db.table), table=sql_db.table)
+
+    METRICS.add_collector(_collect)
+    metrics_server = metrics.Server(METRICS, constants.DAEMON["metrics_port"])
+    if constants.DAEMON["metrics_port"]:
+        metrics_server.start()
+
     # create an object for the management of the BT devices
     with pyly.PyLyManager(debug=DEBUG_HW) as pylyman:
-        cycle_time = np.array([constants.KIMNATY["cycle_time"], constants.AC["cycle_time"]])
         list_of_devices = constants.DEVICES
         for bt_dev in list_of_devices:
             pylyman.subscribe_to(mac=bt_dev["mac"], dev_id=bt_dev["room_id"])
@@ -102,62 +170,315 @@ def main() -> None:  # noqa: C901
         for airco in list_of_aircos:
             airco["device"] = libdaikin.Daikin(airco["ip"])  # type: ignore[no-untyped-call]
 
-        next_sample = np.array([time.time(), time.time()])
-        while not killer.kill_now:
-            # get RH/T data
-            if time.time() > next_sample[0]:
-                start_time = time.time()
-                LOGGER.debug("Updating sensor data...")
-                pylyman.update_all()
-                # fmt: off
-                LOGGER.debug(f">>> {time.time() - start_time:.1f} s to update {len(list_of_devices)} sensors")
-                # fmt: on
-                # get the data from the devices
-                for device in list_of_devices:
-                    dev_qos, dev_data = get_rht_data(pylyman.get_state_of(device["room_id"]))
-                    if dev_qos > 0:
-                        sql_db_rht.queue(dev_data)
-                    else:
-                        LOGGER.warning(f"!!! No data for room {dev_data['room_id']}")
-                    record_qos(dev_qos, dev_data["room_id"])
-                # store the data in the DB
-                try:
-                    sql_db_rht.insert(method="replace")
-                    sql_health.insert(method="replace", index="room_id")
-                except Exception as her:  # pylint: disable=W0703
-                    LOGGER.critical(
-                        f"*** While trying to insert data into the database  {type(her).__name__} {her} "
-                    )
-                    LOGGER.error(traceprint(traceback.format_exc()))
-                    raise  # may be changed to pass if errors can be corrected.
-                next_sample[0] = cycle_time[0] + start_time - (start_time % cycle_time[0])
-
-            # get AC data
-            if time.time() > next_sample[1]:
-                start_time = time.time()
-                # get the data from the devices
-                ac_results = do_work_ac(list_of_aircos)
-                # queue AC sample data
-                if ac_results:
-                    for element in ac_results:
-                        sql_db_ac.queue(element)
-                LOGGER.debug(f" >>> Time to get AC results: {time.time() - start_time:.2f}")
-                # store the data in the DB
-                try:
-                    sql_db_ac.insert(method="replace")
-                except Exception as her:  # pylint: disable=W0703
-                    LOGGER.critical(
-                        f"*** While trying to insert data into the database {type(her).__name__} {her} "
-                    )
-                    LOGGER.error(traceprint(traceback.format_exc()))
-                    raise  # may be changed to pass if errors can be corrected.
-                next_sample[1] = cycle_time[1] + start_time - (start_time % cycle_time[1])
-
-            time.sleep(1.0)
-        # store any still queued results
-        sql_db_rht.insert(method="replace")
-        sql_health.insert(method="replace", index="room_id")
-        sql_db_ac.insert(method="replace")
+        now = time.time()
+        # fmt: off
+        if constants.KIMNATY["stagger"]:
+            schedule_rht_staggered(schedule, pylyman, list_of_devices, sql_db_rht, now)
+        else:
+            schedule.every("rht", constants.KIMNATY["cycle_time"],
+                           functools.partial(sample_rht, pylyman, list_of_devices, sql_db_rht), start=now)
+        schedule.every("ac", constants.AC["cycle_time"],
+                       functools.partial(sample_ac, schedule, list_of_aircos, sql_db_ac), start=now)
+        schedule.every("flush", constants.DAEMON["flush_time"],
+                       functools.partial(flush, [sql_db_rht, sql_db_ac]))
+        schedule.every("health", constants.DAEMON["health_time"], flush_health)
+        schedule.every("rollup", constants.DAEMON["rollup_time"], update_rollups)
+        schedule.every("retention", constants.DAEMON["retention_time"],
+                       functools.partial(apply_retention, schedule))
+        schedule.every("report", constants.DAEMON["report_time"],
+                       functools.partial(report, schedule))
+        # fmt: on
+        try:
+            schedule.run()
+        finally:
+            # store any still queued results
+            flush([sql_db_rht, sql_db_ac])
+            flush_health()
+            room_health.log_stats()
+            database.log_stats()
+            database.close()
+            metrics_server.stop()
+
+
+def sample_rht(pylyman, list_of_devices: list, sql_db_rht) -> None:
+    """Read all BT devices and queue their data.
+
+    Args:
+        pylyman: the manager of the BT devices
+        list_of_devices: list of devices to read
+        sql_db_rht: database table object to queue the data in
+
+    Returns:
+        Nothing
+    """
+    start_time = time.time()
+    LOGGER.debug("Updating sensor data...")
+    # like pylyman.update_all(), but every device is timed
+    for device in list_of_devices:
+        update_device(pylyman, device["room_id"])
+    # check radio
+    pylyman.handle_fails()
+    LOGGER.debug(f">>> {time.time() - start_time:.1f} s to update {len(list_of_devices)} sensors")
+    # get the data from the devices
+    for device in list_of_devices:
+        dev_qos, dev_data = get_rht_data(pylyman.get_state_of(device["room_id"]))
+        if dev_qos > 0:
+            sql_db_rht.queue(dev_data)
+        else:
+            LOGGER.warning(f"!!! No data for room {dev_data['room_id']}")
+        record_qos(dev_qos, dev_data["room_id"])
+
+
+def schedule_rht_staggered(  # pylint: disable=too-many-positional-arguments
+    schedule: scheduler.Scheduler, pylyman, list_of_devices: list, sql_db_rht, start: float
+) -> None:
+    """Schedule a separate task for every BT device.
+
+    The tasks are spread evenly over the cycle, so the BT adapter is never busy
+    for long and a device that is slow to respond only delays itself.
+
+    Args:
+        schedule: the scheduler that runs the daemon's tasks
+        pylyman: the manager of the BT devices
+        list_of_devices: list of devices to read
+        sql_db_rht: database table object to queue the data in
+        start: epoch of the first read
+
+    Returns:
+        Nothing
+    """
+    cycle_time: float = constants.KIMNATY["cycle_time"]
+    ble_lock = threading.Lock()
+    for idx, device in enumerate(list_of_devices):
+        offset = start + idx * cycle_time / len(list_of_devices)
+        schedule.every(
+            f"rht_{device['room_id']}",
+            cycle_time,
+            functools.partial(
+                sample_rht_device,
+                pylyman,
+                device,
+                sql_db_rht,
+                ble_lock,
+                # the radio is checked once per cycle, after the last device
+                check_radio=idx == len(list_of_devices) - 1,
+            ),
+            start=offset,
+            phase=offset % cycle_time,
+        )
+        LOGGER.debug(f"room {device['room_id']} is read at +{offset - start:.0f}s in the cycle")
+
+
+def sample_rht_device(  # pylint: disable=too-many-positional-arguments
+    pylyman, device: dict, sql_db_rht, ble_lock: threading.Lock, check_radio: bool = True
+) -> None:
+    """Read a single BT device and queue its data.
+
+    The read is skipped if another read keeps the BT adapter busy for longer
+    than `read_timeout`. The read itself is not interrupted.
+
+    Args:
+        pylyman: the manager of the BT devices
+        device: the device to read
+        sql_db_rht: database table object to queue the data in
+        ble_lock: lock that prevents simultaneous use of the BT adapter
+        check_radio: let the manager handle the failed devices after the read
+
+    Returns:
+        Nothing
+    """
+    room_id = device["room_id"]
+    read_timeout: float = constants.KIMNATY["read_timeout"]
+    if not ble_lock.acquire(timeout=read_timeout):
+        LOGGER.warning(f"!!! BT adapter busy; skipping room {room_id} this cycle")
+        return
+    try:
+        elapsed = update_device(pylyman, room_id)
+        if check_radio:
+            pylyman.handle_fails()
+    finally:
+        ble_lock.release()
+    if elapsed > read_timeout:
+        LOGGER.warning(f"!!! {elapsed:.1f} s to update room {room_id}")
+    else:
+        LOGGER.debug(f">>> {elapsed:.1f} s to update room {room_id}")
+    dev_qos, dev_data = get_rht_data(pylyman.get_state_of(room_id))
+    if dev_qos > 0:
+        sql_db_rht.queue(dev_data)
+    else:
+        LOGGER.warning(f"!!! No data for room {dev_data['room_id']}")
+    record_qos(dev_qos, dev_data["room_id"])
+
+
+def update_device(pylyman, room_id: str) -> float:
+    """Read a BT device, unless the manager has put it on hold.
+
+    Args:
+        pylyman: the manager of the BT devices
+        room_id: the device to read
+
+    Returns:
+        seconds spent on the device
+    """
+    start_time = time.time()
+    # don't bother to update devices that the manager has put on hold
+    control = pylyman.device_db[room_id]["control"]
+    if start_time > control["next"]:
+        pylyman.update(room_id)
+        control["next"] = time.time()
+        METRIC_BLE_SECONDS.observe(time.time() - start_time, room=room_id)
+    return time.time() - start_time
+
+
+def sample_ac(
+    schedule: scheduler.Scheduler, list_of_aircos: list, sql_db_ac, retry: bool = False
+) -> None:
+    """Read the AC devices and queue their data.
+
+    Devices that failed are scheduled to be read once more at their retry deadline.
+
+    Args:
+        schedule: the scheduler that runs the daemon's tasks
+        list_of_aircos: list of AC devices to read
+        sql_db_ac: database table object to queue the data in
+        retry: True if this is the retry of devices that failed earlier this cycle
+
+    Returns:
+        Nothing
+    """
+    if retry:
+        # devices that were read successfully in the meantime need no retry
+        list_of_aircos = [_ac for _ac in list_of_aircos if _ac["retry_at"]]
+        if not list_of_aircos:
+            return
+    start_time = time.time()
+    for element in do_work_ac(list_of_aircos, retry=retry):
+        sql_db_ac.queue(element)
+    LOGGER.debug(f" >>> Time to get AC results: {time.time() - start_time:.2f}")
+    for airco in list_of_aircos:
+        if airco["retry_at"]:
+            schedule.at(
+                f"ac_retry_{airco['name']}",
+                airco["retry_at"],
+                functools.partial(sample_ac, schedule, [airco], sql_db_ac, retry=True),
+            )
+
+
+def flush(sql_dbs: list) -> None:
+    """Store the queued data in the database.
+
+    Data that was spooled earlier is stored first. Data that can not be stored
+    is moved to the spool, so it survives until the database accepts it again.
+
+    Args:
+        sql_dbs: list of database table objects to store
+
+    Returns:
+        Nothing
+    """
+    for sql_db in sql_dbs:
+        spooled = sample_spool.drain(sql_db.table)
+        for element in spooled:
+            sql_db.queue(element)
+        t0 = time.time()
+        try:
+            sql_db.insert()
+            METRIC_DB_SECONDS.observe(time.time() - t0, table=sql_db.table)
+            if spooled:
+                LOGGER.info(f"Stored {len(spooled)} spooled records in {sql_db.table}")
+        except Exception as her:  # pylint: disable=W0703
+            LOGGER.critical(
+                f"*** While trying to insert data into the database {type(her).__name__} {her} "
+            )
+            LOGGER.error(traceprint(traceback.format_exc()))
+            METRIC_DB_FAILURES.inc(table=sql_db.table)
+            # move what was not stored to the spool; samples queued meanwhile stay queued
+            leftovers = sql_db.dataq[:]
+            sample_spool.append(sql_db.table, leftovers)
+            del sql_db.dataq[: len(leftovers)]
+        sample_spool.commit(sql_db.table)
+
+
+def flush_health() -> None:
+    """Store the changed health of the rooms in the database.
+
+    Changes that can not be stored are kept in memory for the next attempt.
+    """
+    try:
+        room_health.flush()
+    except Exception as her:  # pylint: disable=W0703
+        LOGGER.critical(
+            f"*** While trying to store room health in the database {type(her).__name__} {her} "
+        )
+        LOGGER.error(traceprint(traceback.format_exc()))
+
+
+def update_rollups() -> None:
+    """Bring the hourly and daily rollups of the samples up to date.
+
+    A failed update is retried by the next run; nothing is lost.
+    """
+    try:
+        written = database.execute(rollup.catch_up)
+        LOGGER.debug(f"Rollups updated: {written}")
+    except Exception as her:  # pylint: disable=W0703
+        LOGGER.critical(f"*** While trying to update the rollups {type(her).__name__} {her} ")
+        LOGGER.error(traceprint(traceback.format_exc()))
+
+
+def record_run(task: scheduler.Task, drift: float, duration: float) -> None:
+    """Add a run of a task to the metrics of the schedule."""
+    METRIC_TASK_SECONDS.observe(duration, task=task.name)
+    METRIC_TASK_DRIFT.observe(drift, task=task.name)
+
+
+def record_skip(task: scheduler.Task) -> None:
+    """Count a skipped run of a task in the metrics of the schedule."""
+    METRIC_TASK_SKIPPED.inc(task=task.name)
+
+
+def apply_retention(schedule: scheduler.Scheduler) -> None:
+    """Compact the raw samples that are older than the retention period.
+
+    Stops early when the daemon is stopped; the next run continues where it left off.
+    """
+    try:
+        retention.apply(database, constants.RETENTION, stop=lambda: schedule.stopped)
+    except Exception as her:  # pylint: disable=W0703
+        LOGGER.critical(f"*** While trying to compact old samples {type(her).__name__} {her} ")
+        LOGGER.error(traceprint(traceback.format_exc()))
+
+
+def report(schedule: scheduler.Scheduler) -> None:
+    """Log the statistics of the scheduler and the room health cache."""
+    schedule.log_drift()
+    room_health.log_stats()
+    database.log_stats()
+    log_footprint()
+
+
+def log_footprint() -> None:
+    """Log the peak resident memory of the daemon and warn about heavy imports."""
+    # ru_maxrss is in kiB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    LOGGER.info(f"Peak RSS {peak_rss:.1f} MiB; {len(sys.modules)} modules loaded")
+    heavy = [_mod for _mod in HEAVY_MODULES if _mod in sys.modules]
+    if heavy:
+        LOGGER.warning(f"Heavy modules were imported: {', '.join(heavy)}")
+
+
+def process_age() -> float:
+    """Return the number of seconds since the process was started."""
+    try:
+        with open("/proc/self/stat", encoding="utf-8") as stat:
+            # the process name may contain spaces; field 22 (starttime) is counted after it
+            fields = stat.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", encoding="utf-8") as uptime:
+            now = float(uptime.read().split()[0])
+        return now - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        # no procfs; the CPU time spent so far is the next best thing
+        return time.process_time()
 
 
 def record_qos(dev_qos: int, room_id: str) -> None:
@@ -170,6 +491,7 @@ def record_qos(dev_qos: int, room_id: str) -> None:
     Returns:
         Nothing
     """
+    METRIC_BLE_QOS.set(dev_qos, room=room_id)
     led_colour = "orange"
     if dev_qos < 10:
         led_colour = "red"
@@ -180,10 +502,10 @@ def record_qos(dev_qos: int, room_id: str) -> None:
 
 
 def log_health_score(room_id: str, state: int) -> None:
-    """Store the state of a device in the database."""
-    old_state = constants.get_health(room_id)
+    """Store the state of a device in the room health cache."""
+    old_state = room_health.health(room_id)
     LOGGER.debug(f"         previous state = {old_state}; new state = {state}")
-    sql_health.queue({"health": state, "room_id": room_id, "name": constants.ROOMS[room_id]})
+    room_health.update(room_id, state, name=ROOM_NAMES.get(room_id, ""))
 
 
 def get_rht_data(dev_dict: dict) -> tuple[int, dict]:
@@ -240,30 +562,35 @@ def get_rht_data(dev_dict: dict) -> tuple[int, dict]:
     }
 
 
-def do_work_ac(dev_list: list) -> list:
-    """Scan the devices to get current readings.
+def do_work_ac(dev_list: list, retry: bool = False) -> list:
+    """Read the given AC devices concurrently.
+
+    Devices that fail to respond are not retried here. Instead they get a
+    deadline (`retry_at`) after which the main loop may try them once more.
+
     Args:
         dev_list: list of device objects
+        retry: True if this is the retry of devices that failed earlier this cycle
 
     Returns:
         (list) containing dicts with data
     """
     data_list = []
-    retry_list = []
-    for airco in dev_list:
-        succes, data = get_ac_data(airco)
-        if succes:
-            data_list.append(data)
-        else:
-            retry_list.append(airco)
-
-    if retry_list:
-        LOGGER.info("Retrying failed connections in 13s...")
-        time.sleep(13.0)
-        for airco in retry_list:
-            succes, data = get_ac_data(airco)
+    workers = max(1, min(len(dev_list), constants.AC["max_workers"]))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(get_ac_data, airco): airco for airco in dev_list}
+        for future in concurrent.futures.as_completed(futures):
+            airco = futures[future]
+            succes, data = future.result()
             if succes:
                 data_list.append(data)
+                airco["retry_at"] = 0.0
+            elif retry:
+                LOGGER.warning(f"!!! No data for {airco['name']} this cycle")
+                airco["retry_at"] = 0.0
+            else:
+                airco["retry_at"] = time.time() + constants.AC["retry_delay"]
+                LOGGER.info(f"Retrying {airco['name']} in {constants.AC['retry_delay']}s...")
     return data_list
 
 
@@ -277,54 +604,47 @@ def get_ac_data(airco) -> tuple[bool, dict]:
         (bool)  to indicate success or failure to read a device's data
         (dict)  device's data; keys match fieldnames in the database
     """
-    ac_pwr = ac_mode = ac_cmp = 0
-    ac_t_in = ac_t_tgt = ac_t_out = 18.0
-    success = False
     t0 = time.time()
     try:
         LOGGER.debug(f"Fetching data from {airco['name']}")
-        ac_pwr = int(airco["device"].power)
-        ac_mode = int(airco["device"].mode)
-        ac_cmp = int(airco["device"].compressor_frequency)
-        ac_t_in = float(airco["device"].inside_temperature)
-        ac_t_out = float(airco["device"].outside_temperature)
-        ac_t_tgt = float(airco["device"].target_temperature)
-        success = True
-    except ValueError:
-        # When switched to fan-mode the temperature target becomes '--'
-        # When switched to drying mode the temperature target becomes 'M'
-        ac_t_tgt = ac_t_in
-        success = True
+        snapshot: libdaikin.DaikinSnapshot = airco["device"].snapshot()
     except libdaikin.DaikinException as her:
         LOGGER.critical(f"!!! {her}")
         LOGGER.info(traceprint(traceback.format_exc()))
-        pass
+        METRIC_AC_FAILURES.inc(airco=airco["name"])
+        return False, {"room_id": airco["name"]}
     except Exception as her:  # pylint: disable=W0703
         LOGGER.critical(f"*** While talking to {airco['name']} {type(her).__name__} {her}")
         LOGGER.info(traceprint(traceback.format_exc()))
-        pass
+        METRIC_AC_FAILURES.inc(airco=airco["name"])
+        return False, {"room_id": airco["name"]}
+    finally:
+        METRIC_AC_SECONDS.observe(time.time() - t0, airco=airco["name"])
 
     LOGGER.debug(f"+----------------Room {airco['name']} Data----")
-    LOGGER.debug(f"| T(airco)  : Inside      {ac_t_in:.2f} degC state = {ac_pwr}")
-    LOGGER.debug(f"|             Target >>>> {ac_t_tgt:.2f} degC  mode = {ac_mode}")
-    LOGGER.debug(f"|             Outside     {ac_t_out:.2f} degC")
-    LOGGER.debug(f"| compressor: {ac_cmp:.0f} ")
+    LOGGER.debug(
+        f"| T(airco)  : Inside      {snapshot.inside_temperature:.2f} degC state = {snapshot.power}"
+    )
+    LOGGER.debug(
+        f"|             Target >>>> {snapshot.target_temperature:.2f} degC  mode = {snapshot.mode}"
+    )
+    LOGGER.debug(f"|             Outside     {snapshot.outside_temperature} degC")
+    LOGGER.debug(f"| compressor: {snapshot.compressor_frequency:.0f} ")
     LOGGER.debug("+---------------------------------------------")
     LOGGER.debug(f"{time.time() - t0:.2f} seconds\n")
 
-    out_date = dt.datetime.now()  # time.strftime('%Y-%m-%dT%H:%M:%S')
-    out_epoch = int(out_date.timestamp())
+    out_date = dt.datetime.fromtimestamp(snapshot.timestamp)
 
-    return success, {
+    return True, {
         "sample_time": out_date.strftime(constants.DT_FORMAT),
-        "sample_epoch": out_epoch,
+        "sample_epoch": int(snapshot.timestamp),
         "room_id": airco["name"],
-        "ac_power": ac_pwr,
-        "ac_mode": ac_mode,
-        "temperature_ac": ac_t_in,
-        "temperature_target": ac_t_tgt,
-        "temperature_outside": ac_t_out,
-        "cmp_freq": ac_cmp,
+        "ac_power": snapshot.power,
+        "ac_mode": snapshot.mode,
+        "temperature_ac": snapshot.inside_temperature,
+        "temperature_target": snapshot.target_temperature,
+        "temperature_outside": snapshot.outside_temperature,
+        "cmp_freq": snapshot.compressor_frequency,
     }
 
 
@@ -370,6 +690,16 @@ if __name__ == "__main__":
         if len(LOGGER.handlers) == 0:
             LOGGER.addHandler(logging.StreamHandler(sys.stdout))
         LOGGER.level = logging.DEBUG
+        for _logger in (
+            scheduler.LOGGER,
+            kimdb.LOGGER,
+            retention.LOGGER,
+            rollup.LOGGER,
+            spool.LOGGER,
+            metrics.LOGGER,
+        ):
+            _logger.addHandler(logging.StreamHandler(sys.stdout))
+            _logger.level = logging.DEBUG
         LOGGER.debug("Debug-mode started.")
         print("Use <Ctrl>+C to stop.")
 
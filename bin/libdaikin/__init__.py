@@ -1,3 +1,15 @@
-from .libdaikin import Daikin, DaikinConnectError, DaikinException, DaikinTimeout
+from .libdaikin import (
+    Daikin,
+    DaikinConnectError,
+    DaikinException,
+    DaikinSnapshot,
+    DaikinTimeout,
+)
 
-__all__ = ["Daikin", "DaikinException", "DaikinTimeout", "DaikinConnectError"]
+__all__ = [
+    "Daikin",
+    "DaikinException",
+    "DaikinSnapshot",
+    "DaikinTimeout",
+    "DaikinConnectError",
+]
@@ -42,6 +42,11 @@ Example usage:
 #>>> API.target_temperature
 22.5
 
+#>>> API.snapshot()
+DaikinSnapshot(host='192.168.1.30', timestamp=1718000000.0, power=1, mode=3,
+               target_temperature=22.5, compressor_frequency=12,
+               inside_temperature=21.0, outside_temperature=16.0)
+
 ref:
 https://knx-user-forum.de/forum/projektforen/edomi/1260809-lbs-19001680-daikin-control/page2
 https://gl.petatech.eu/root/HomeBot/-/blob/bb600c00ebaaccdc0ab6edf1515b15b6d0551beb/FHEM/58_HVAC_DaikinAC.pm
@@ -63,10 +68,17 @@ Traveltime V-louvre (U-D-U): 54.0s ± 0.2s
 # mypy: ignore-errors
 
 import logging
+import threading
 import time
 import urllib.parse
+from dataclasses import dataclass
 
 import requests
+from requests.adapters import HTTPAdapter
+
+_SESSIONS: dict = {}
+"""keep-alive HTTP sessions shared by all Daikin objects; one per host"""
+_SESSIONS_LOCK = threading.Lock()
 
 
 class DaikinException(Exception):
@@ -94,6 +106,83 @@ class DaikinConnectError(DaikinException):
         DaikinException.__init__(self, message)
 
 
+@dataclass(frozen=True)
+class DaikinSnapshot:
+    """State of a unit taken from one control request and one sensor request.
+
+    Attributes:
+        host (str): hostname or IP address of the unit
+        timestamp (float): UN*X epoch of when the sensor data was received
+        power (int): 1 for ON, 0 for OFF
+        mode (int): operation mode (see `Daikin.mode`)
+        target_temperature (float): target temperature [degC]; when the unit has
+                                    no target (FAN: '--', DRY: 'M') this is the
+                                    inside temperature
+        compressor_frequency (int): compressor frequency
+        inside_temperature (float): inside temperature [degC]
+        outside_temperature (float): outside temperature [degC] or None if the
+                                     unit does not report it
+    """
+
+    host: str
+    timestamp: float
+    power: int
+    mode: int
+    target_temperature: float
+    compressor_frequency: int
+    inside_temperature: float
+    outside_temperature: float | None
+
+
+def _to_float(value, default=None):
+    """Convert a field returned by the unit to a float.
+
+    Args:
+        value (str): raw field value e.g. '22.5', '--' or 'M'
+        default (float): value to return if `value` is not a number
+
+    Returns:
+        float: converted value or `default`
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _get_session(host, pool_size):
+    """Return the shared keep-alive session for `host`; create it if needed.
+
+    Args:
+        host (str): hostname or IP address of the unit
+        pool_size (int): maximum number of connections kept open to the unit
+
+    Returns:
+        requests.Session
+    """
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(host)
+        if session is None:
+            session = requests.Session()
+            # retries are handled by Daikin._request() to recover stale connections
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+            session.mount(f"http://{host}/", adapter)
+            _SESSIONS[host] = session
+        return session
+
+
+def _drop_session(host):
+    """Close the shared session for `host` so the next request starts afresh.
+
+    Args:
+        host (str): hostname or IP address of the unit
+    """
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.pop(host, None)
+    if session is not None:
+        session.close()
+
+
 class Daikin:
     """Class to get information from Daikin Wireless LAN Connecting Adapter"""
 
@@ -122,14 +211,79 @@ class Daikin:
 
     _host = None
 
-    def __init__(self, host):
+    def __init__(self, host, pool_size=1, connect_timeout=3.05, read_timeout=6.0):
         """Initialise Daikin Aircon API
 
+        Connections are kept alive and shared between all Daikin objects that
+        talk to the same host.
+
         Args:
             host (str): hostname or IP address to connect to
+            pool_size (int): maximum number of connections kept open to the host
+            connect_timeout (float): seconds to wait for the unit to accept a connection
+            read_timeout (float): seconds to wait for the unit to answer a request
         """
         self._host = host
+        self._pool_size = pool_size
+        self._timeout = (connect_timeout, read_timeout)
         self.data_timestamp: float = 0.0
+        self._pool = None
+        self._connections = 0
+        # number of requests and total seconds spent; for new and for reused connections
+        self.http_stats = {"new": [0, 0.0], "reused": [0, 0.0]}
+
+    def _request(self, path, params=None):
+        """Internal function to perform a GET request over the shared session
+
+        A connection that was closed by the unit while idle is detected when it
+        is reused. In that case the session is dropped and the request is tried
+        once more over a fresh connection.
+
+        Args:
+            path (str): URL to request
+            params (dict): parameters to add to the URL
+
+        Returns:
+            requests.Response
+        """
+        url = f"http://{self._host}{path}"
+        for attempt in (1, 2):
+            session = _get_session(self._host, self._pool_size)
+            t0 = time.time()
+            try:
+                response = session.get(url, params=params, timeout=self._timeout)
+            except requests.exceptions.Timeout as her:
+                raise DaikinTimeout(f"Timeout getting {self._host}{path}") from her
+            except requests.exceptions.ConnectionError as her:
+                if attempt == 1 and self._pool is not None:
+                    logging.debug(f"Stale connection to {self._host}; reconnecting")
+                    self._pool = None
+                    _drop_session(self._host)
+                    continue
+                raise DaikinConnectError(f"Connection error getting {self._host}{path}") from her
+            break
+        elapsed = time.time() - t0
+        # urllib3 counts the connections it had to open for the pool
+        pool = getattr(response.raw, "_pool", None)
+        connections = getattr(pool, "num_connections", -1)
+        kind = "new"
+        if pool is not None and pool is self._pool and connections == self._connections:
+            kind = "reused"
+        self._pool = pool
+        self._connections = connections
+        self.http_stats[kind][0] += 1
+        self.http_stats[kind][1] += elapsed
+        logging.debug(
+            f"{self._host}{path} : {elapsed:.3f}s over {kind} connection "
+            f"(avg new {self._avg_latency('new'):.3f}s; "
+            f"avg reused {self._avg_latency('reused'):.3f}s)"
+        )
+        return response
+
+    def _avg_latency(self, kind):
+        """Return the average request time for `kind` ('new' or 'reused') connections"""
+        count, total = self.http_stats[kind]
+        return total / count if count else 0.0
 
     def _get(self, path):
         """Internal function to connect to and get any information
@@ -140,12 +294,7 @@ class Daikin:
         Returns:
             dict: returned data converted to a dict
         """
-        try:
-            response = requests.get(f"http://{self._host}{path}", timeout=6)
-        except requests.exceptions.Timeout as her:
-            raise DaikinTimeout(f"Timeout getting {self._host}{path}") from her
-        except requests.exceptions.ConnectionError as her:
-            raise DaikinConnectError(f"Connection error getting {self._host}{path}") from her
+        response = self._request(path)
         response.raise_for_status()
         logging.debug(response.text)
         if not len(response.text) > 0 or response.text[0:4] != "ret=":
@@ -163,7 +312,7 @@ class Daikin:
     def _set(self, path, data):
         """Internal function to connect to and update information"""
         logging.debug(data)
-        response = requests.get(f"http://{self._host}{path}", data, timeout=3)
+        response = self._request(path, params=data)
         response.raise_for_status()
         logging.debug(response.text)
 
@@ -486,6 +635,56 @@ class Daikin:
         """
         return float(self._get_sensor()["otemp"])
 
+    def snapshot(self):
+        """Read the control and sensor information of the unit in one go.
+
+        Each endpoint is requested exactly once, so all values in the snapshot
+        belong to the same moment. Use this instead of reading the separate
+        properties when more than one value is needed.
+
+        Returns:
+            DaikinSnapshot: current state of the unit
+
+        Raises:
+            DaikinException: when the unit returns incomplete data
+        """
+        control = self._get("/aircon/get_control_info")
+        sensor = self._get("/aircon/get_sensor_info")
+        return self._parse_snapshot(control, sensor, self.data_timestamp)
+
+    def _parse_snapshot(self, control, sensor, timestamp):
+        """Convert the raw control and sensor fields into a DaikinSnapshot
+
+        Args:
+            control (dict): fields returned by /aircon/get_control_info
+            sensor (dict): fields returned by /aircon/get_sensor_info
+            timestamp (float): UN*X epoch of the data
+
+        Returns:
+            DaikinSnapshot
+        """
+        try:
+            inside_temperature = float(sensor["htemp"])
+            power = int(control["pow"])
+            mode = int(control["mode"])
+            compressor_frequency = int(sensor["cmpfreq"])
+            raw_target = control["stemp"]
+            raw_outside = sensor["otemp"]
+        except (KeyError, ValueError) as her:
+            raise DaikinException(f"Incomplete data from {self._host}: {her}") from her
+        return DaikinSnapshot(
+            host=self._host,
+            timestamp=timestamp,
+            power=power,
+            mode=mode,
+            # When switched to fan-mode the temperature target becomes '--'
+            # When switched to drying mode the temperature target becomes 'M'
+            target_temperature=_to_float(raw_target, inside_temperature),
+            compressor_frequency=compressor_frequency,
+            inside_temperature=inside_temperature,
+            outside_temperature=_to_float(raw_outside),
+        )
+
     def _get_all(self):
         """Get and aggregate all data endpoints
 
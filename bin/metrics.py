@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+# kimnaty
+# Copyright (C) 2024  Maurice (mausy5043) Hendrix
+# AGPL-3.0-or-later  - see LICENSE
+
+"""Expose the metrics of the daemon in the Prometheus text format.
+
+Counters, gauges and histograms are updated by the tasks of the daemon. That
+only takes a lock for the duration of a few additions, so the sampling never
+waits for a scrape. The metrics are served by an HTTP server in a thread of its
+own, e.g.:
+    curl http://127.0.0.1:9150/metrics
+
+Only the standard library is used, to keep the daemon small.
+"""
+
+import bisect
+import http.server
+import logging
+import math
+import threading
+from collections.abc import Callable, Iterator
+from typing import TypeVar
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds; from a quick database insert to a slow scan of a BT device
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0, 120.0,
+)  # fmt: skip
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    """A family of samples with the same name; one per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        """Initialise the metric.
+
+        Args:
+            name: name of the metric, e.g. kimnaty_db_insert_seconds
+            documentation: the HELP text of the metric
+            labelnames: names of the labels that tell the samples apart
+        """
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: tuple[str, ...] = labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} needs the labels {self.labelnames}; got {tuple(labels)}"
+            )
+        return tuple(str(labels[_l]) for _l in self.labelnames)
+
+    def _samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in sorted(values):
+            yield self.name, dict(zip(self.labelnames, key, strict=True)), value
+
+    def render(self) -> str:
+        """Return the metric in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+_M = TypeVar("_M", bound=_Metric)
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. the number of failed requests."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        """Add `amount` to the counter of `labels`."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, e.g. the length of a queue."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the gauge of `labels` to `value`."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    """The distribution of observed values, e.g. of the duration of a task."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        """Initialise the histogram.
+
+        Args:
+            name: name of the metric, e.g. kimnaty_db_insert_seconds
+            documentation: the HELP text of the metric
+            labelnames: names of the labels that tell the samples apart
+            buckets: upper bounds of the buckets; +Inf is added
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+        # per combination of label values: the count per bucket (not cumulative), sum, count
+        self._histograms: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Add an observation to the histogram of `labels`."""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = ([0] * (len(self.buckets) + 1), [0.0, 0.0])
+                self._histograms[key] = histogram
+            histogram[0][index] += 1
+            histogram[1][0] += value
+            histogram[1][1] += 1
+
+    def _samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        with self._lock:
+            histograms = [(_k, list(_c), list(_t)) for _k, (_c, _t) in self._histograms.items()]
+        for key, counts, (total, count) in sorted(histograms):
+            labels = dict(zip(self.labelnames, key, strict=True))
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, math.inf), counts, strict=True):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class Registry:
+    """The metrics of the daemon and the callbacks that update them before a scrape."""
+
+    def __init__(self) -> None:
+        """Initialise an empty registry."""
+        self._metrics: list[_Metric] = []
+        self._collectors: list[Callable[[], None]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        """Create and register a counter."""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        """Create and register a gauge."""
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Create and register a histogram."""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric: _M) -> _M:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, callback: Callable[[], None]) -> None:
+        """Call `callback` before every scrape, e.g. to set gauges that are cheap to read."""
+        self._collectors.append(callback)
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text format."""
+        for callback in self._collectors:
+            try:
+                callback()
+            except Exception as her:  # pylint: disable=W0703
+                # a broken collector must not take the other metrics down
+                LOGGER.error(f"*** Metrics collector failed: {type(her).__name__} {her}")
+        return "".join(_metric.render() for _metric in self._metrics)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Serve the metrics of the registry of the server at /metrics."""
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()  # type: ignore[attr-defined]
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        LOGGER.debug(f"{self.address_string()} {format % args}")
+
+
+class Server:
+    """HTTP server that serves a registry from a daemon thread."""
+
+    def __init__(self, registry: Registry, port: int, host: str = "127.0.0.1") -> None:
+        """Initialise the server; `start()` binds the port.
+
+        Args:
+            registry: the metrics to serve
+            port: TCP port to listen on
+            host: address to listen on; only local clients by default
+        """
+        self.registry: Registry = registry
+        self.address: tuple[str, int] = (host, port)
+        self._httpd: http.server.ThreadingHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> bool:
+        """Start serving; return False if the port could not be bound."""
+        try:
+            self._httpd = http.server.ThreadingHTTPServer(self.address, _Handler)
+        except OSError as her:
+            LOGGER.error(f"*** Can not serve metrics on {self.address}: {her}")
+            return False
+        self._httpd.daemon_threads = True
+        self._httpd.registry = self.registry  # type: ignore[attr-defined]
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="metrics", daemon=True
+        )
+        self._thread.start()
+        LOGGER.info(f"Serving metrics on http://{self.address[0]}:{self.address[1]}/metrics")
+        return True
+
+    def stop(self) -> None:
+        """Stop serving and release the port."""
+        if self._httpd is None:
+            return
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._httpd = None
@@ -37,8 +37,6 @@ fi
 
 if [ "${MAINTENANCE}" == "-" ]; then
     # do some maintenance
-    CURRENT_EPOCH=$(date +'%s')
-
     # shellcheck disable=SC2154
     echo "${db_full_path} re-indexing... "
     execute_sql "${db_full_path}" "REINDEX;"
@@ -54,16 +52,9 @@ if [ "${MAINTENANCE}" == "-" ]; then
                     "${database_local_root}/${app_name}/${database_filename}" \
                     "${database_remote_root}/backup/${database_filename}"
         fi
-
-        # Keep upto 10 years of data
-        echo "${db_full_path} vacuuming... "
-        PURGE_EPOCH=$(echo "${CURRENT_EPOCH} - (3660 * 24 * 3600)" |bc)
-        execute_sql "${db_full_path}" \
-                "DELETE FROM data WHERE sample_epoch < ${PURGE_EPOCH};"
-        execute_sql "${db_full_path}" \
-                "DELETE FROM aircon WHERE sample_epoch < ${PURGE_EPOCH};"
+        # old raw samples are compacted by the daemon; see retention.py
     else
-        echo "Database integrity check failed. Skipping backup and vacuuming." >&2
+        echo "Database integrity check failed. Skipping backup." >&2
     fi
     # sync the database into the cloud
     if command -v rclone &> /dev/null; then
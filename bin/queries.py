@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+# kimnaty
+# Copyright (C) 2024  Maurice (mausy5043) Hendrix
+# AGPL-3.0-or-later  - see LICENSE
+
+"""Build the queries for the trend graphs and check that they use the indexes.
+
+All queries select an integer range of `sample_epoch` for an exact list of
+rooms, so SQLite can use the composite (room_id, sample_epoch) indexes.
+
+Run this module to print the query plans and fail if any query scans a
+table, e.g.:
+    python3 queries.py                      # schema from sq3_kimnaty.sql
+    python3 queries.py path/to/kimnaty.v2.sqlite3
+"""
+
+import argparse
+import sqlite3 as s3
+import sys
+
+import kimdb
+import retention
+import rollup
+
+# composite indexes that serve the queries of this module
+INDEXES: list[str] = [
+    "CREATE INDEX IF NOT EXISTS idx_data_room_epoch ON data(room_id, sample_epoch);",
+    "CREATE INDEX IF NOT EXISTS idx_ac_room_epoch ON aircon(room_id, sample_epoch);",
+]
+# indexes made redundant by the composite indexes
+OBSOLETE_INDEXES: list[str] = ["idx_data_room", "idx_ac_room"]
+
+
+def ensure_indexes(con: s3.Connection) -> None:
+    """Create the composite indexes and drop the ones they replace.
+
+    Args:
+        con: connection to the database
+    """
+    for sql in INDEXES:
+        con.execute(sql)
+    for index in OBSOLETE_INDEXES:
+        con.execute(f"DROP INDEX IF EXISTS {index};")
+
+
+def stored_room_id(room_id: str) -> float | int | str:
+    """Return `room_id` the way SQLite stores it in a column with INTEGER affinity.
+
+    e.g. '1.1' is stored as 1.1, '1.0' as 1 and 'airco0' stays as it is.
+    """
+    try:
+        value = float(room_id)
+    except ValueError:
+        return room_id
+    return int(value) if value.is_integer() else value
+
+
+def epoch_range(con: s3.Connection, edatetime: str, hours_to_fetch: int) -> tuple[int, int]:
+    """Return the range of epochs to fetch.
+
+    Args:
+        con: connection to the database
+        edatetime: quoted SQLite time value of the end of the graph, e.g. "'now'"
+        hours_to_fetch: number of hours of data before `edatetime`
+
+    Returns:
+        first and last epoch to fetch
+    """
+    first, last = con.execute(
+        f"SELECT CAST(strftime('%s', {edatetime}, '-{hours_to_fetch + 1} hours') AS INTEGER),"
+        f" CAST(strftime('%s', {edatetime}, '+2 hours') AS INTEGER);"
+    ).fetchone()
+    return first, last
+
+
+def rooms_query(  # pylint: disable=too-many-positional-arguments
+    table: str,
+    columns: list[str],
+    n_rooms: int,
+    bucket: int = 0,
+    offset: int = 0,
+    summary: rollup.Rollup | None = None,
+) -> str:
+    """Return the query for the samples of `n_rooms` rooms in a range of epochs.
+
+    The parameters of the query are the room_ids followed by the first and the
+    last epoch.
+
+    Args:
+        table: name of the table with the samples
+        columns: numeric columns to fetch
+        n_rooms: number of rooms
+        bucket: if not 0, select the mean, the minimum and the maximum of `columns` per
+                `bucket` seconds per room; the latter two as f"{column}_min" and f"{column}_max"
+        offset: seconds to shift the buckets by, e.g. to align them to local time
+        summary: select the sums, counts, minima and maxima of `columns` from this rollup
+                 instead
+
+    Returns:
+        the query
+    """
+    placeholders = ", ".join("?" for _ in range(n_rooms))
+    where_condition = f"room_id IN ({placeholders}) AND sample_epoch >= ? AND sample_epoch <= ?"
+    if summary is not None:
+        totals = ", ".join(f"{_c}_sum, {_c}_n, {_c}_min, {_c}_max" for _c in columns)
+        return (
+            f"SELECT room_id, sample_epoch, {totals}"
+            f" FROM {summary.table} WHERE {where_condition}"  # nosec B608
+        )
+    if bucket:
+        # the BT devices report fractional epochs; those need an integer division too
+        bucket_nr = f"((CAST(sample_epoch AS INTEGER) + {offset}) / {bucket})"
+        means = ", ".join(
+            f"AVG({_c}) AS {_c}, MIN({_c}) AS {_c}_min, MAX({_c}) AS {_c}_max" for _c in columns
+        )
+        return (
+            f"SELECT room_id, {bucket_nr} * {bucket} - {offset} AS sample_epoch, {means}"
+            f" FROM {table} WHERE {where_condition}"  # nosec B608
+            f" GROUP BY room_id, {bucket_nr}"
+        )
+    return (
+        f"SELECT room_id, sample_epoch, {', '.join(columns)}"
+        f" FROM {table} WHERE {where_condition}"  # nosec B608
+    )
+
+
+def new_rows_query(table: str, columns: list[str], n_rooms: int) -> str:
+    """Return the query for the samples of `n_rooms` rooms in a range of epochs added
+    after a given rowid.
+
+    The parameters of the query are the room_ids, the first and the last epoch and
+    the rowid. Use rowid 0 to get all samples in the range.
+
+    Args:
+        table: name of the table with the samples
+        columns: numeric columns to fetch
+        n_rooms: number of rooms
+
+    Returns:
+        the query
+    """
+    placeholders = ", ".join("?" for _ in range(n_rooms))
+    return (
+        f"SELECT rowid, room_id, sample_epoch, {', '.join(columns)}"
+        f" FROM {table} WHERE room_id IN ({placeholders})"  # nosec B608
+        f" AND sample_epoch >= ? AND sample_epoch <= ? AND rowid > ?"
+    )
+
+
+def window_query(table: str, n_rooms: int) -> str:
+    """Return the query for the number, the last epoch and the highest rowid of the
+    samples of `n_rooms` rooms in a range of epochs.
+
+    The parameters of the query are the room_ids followed by the first and the
+    last epoch. Only the index is read, so this tells cheaply whether the samples
+    in the range changed.
+
+    Args:
+        table: name of the table with the samples
+        n_rooms: number of rooms
+
+    Returns:
+        the query
+    """
+    placeholders = ", ".join("?" for _ in range(n_rooms))
+    return (
+        f"SELECT COUNT(*), MAX(sample_epoch), MAX(rowid) FROM {table}"  # nosec B608
+        f" WHERE room_id IN ({placeholders}) AND sample_epoch >= ? AND sample_epoch <= ?"
+    )
+
+
+def explain(con: s3.Connection, sql: str, params: list) -> list[str]:
+    """Return the lines of the query plan of `sql`."""
+    return [_row[-1] for _row in con.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def check_plans(con: s3.Connection) -> list[str]:
+    """Explain the trend and rollup queries and report the ones that do not use an index.
+
+    The queries for a range of epochs of a list of rooms must search on both
+    room_id and sample_epoch; the other queries must not scan a table.
+
+    Args:
+        con: connection to a database with the kimnaty schema
+
+    Returns:
+        a description of every query with a bad plan
+    """
+    room_range = "(room_id=? AND sample_epoch>? AND sample_epoch<?)"
+    queries: list[tuple[str, list, str]] = []
+    for n_rooms in (1, 7):
+        params = [f"{_i}.1" for _i in range(n_rooms)] + [0, 1]
+        for source, columns in rollup.COLUMNS.items():
+            queries.append((rooms_query(source, columns, n_rooms), params, room_range))
+            queries.append(
+                (rooms_query(source, columns, n_rooms, 21600, 7200), params, room_range)
+            )
+            queries.append((new_rows_query(source, columns, n_rooms), [*params, 0], "SEARCH"))
+            queries.append((window_query(source, n_rooms), params, room_range))
+        for summary in rollup.ROLLUPS:
+            queries.append(
+                (
+                    rooms_query(summary.source, summary.columns, n_rooms, 3600, 0, summary),
+                    params,
+                    room_range,
+                )
+            )
+    for summary in rollup.ROLLUPS:
+        queries.append(
+            (
+                f"SELECT * FROM {summary.source} WHERE rowid > ? AND rowid <= ?",
+                [0, 1],
+                "rowid>? AND rowid<?",
+            )
+        )
+    for source in rollup.COLUMNS:
+        queries.append((retention.batch_query(source), [0, 1, 1], "sample_epoch<?"))
+    problems = []
+    for sql, params, expected in queries:
+        plan = explain(con, sql, params)
+        if any(_line.startswith("SCAN") and "USING" not in _line for _line in plan) or not any(
+            expected in _line for _line in plan
+        ):
+            problems.append(f"{sql}\n    {plan}")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the query plans of the trend queries.")
+    parser.add_argument("database", nargs="?", help="database to check (default: a new one)")
+    OPTION = parser.parse_args()
+    if OPTION.database:
+        _con = s3.connect(f"file:{OPTION.database}?mode=ro", uri=True)
+    else:
+        _con = s3.connect(":memory:")
+        kimdb.create_schema(_con)
+    _problems = check_plans(_con)
+    for _problem in _problems:
+        print(f"Table scan in: {_problem}")
+    if _problems:
+        sys.exit(1)
+    print("All queries use an index.")
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+# kimnaty
+# Copyright (C) 2024  Maurice (mausy5043) Hendrix
+# AGPL-3.0-or-later  - see LICENSE
+
+"""Compact the raw samples that are older than the retention period of their table.
+
+The hourly and daily rollups keep the count, sum, minimum and maximum of every
+sample, so old raw samples can go once the rollups cover them. They are deleted
+in small batches, each in a transaction of its own, so the daemon never waits
+long for the write lock. Only whole days are deleted. A sample that arrives
+late for a deleted day is added to the buckets of that day by the next catch-up
+of the rollups. --check verifies this on a database with synthetic samples.
+
+The pages that the deleted samples occupied are given back to the filesystem by
+`PRAGMA incremental_vacuum`. That needs `auto_vacuum=INCREMENTAL`; switch a
+database to it once with --convert (this rewrites the whole file), e.g.:
+    python3 retention.py --convert
+    python3 retention.py --days 400
+    python3 retention.py --check
+The daemon applies the policy in constants.RETENTION every `retention_time`
+seconds.
+"""
+
+import argparse
+import contextlib
+import logging
+import math
+import os
+import random
+import sqlite3 as s3
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+
+import constants
+import kimdb
+import rollup
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+DAY = 86400
+# PRAGMA auto_vacuum
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def batch_query(table: str) -> str:
+    """Return the statement that deletes a batch of the oldest samples of `table`.
+
+    The parameters are the first epoch to keep, the highest rowid that may be
+    deleted and the size of the batch.
+    """
+    return (
+        f"DELETE FROM {table} WHERE rowid IN ("  # nosec B608
+        f"SELECT rowid FROM {table} WHERE sample_epoch < ? AND rowid <= ? LIMIT ?)"
+    )
+
+
+def cutoff(days: int, now: float) -> int:
+    """Return the epoch of the first sample to keep: `days` before `now`, at a whole day."""
+    return (int(now) - days * DAY) // DAY * DAY
+
+
+def rolled_up(con: s3.Connection, table: str) -> int:
+    """Return the highest rowid of `table` that all of its rollups include."""
+    names = [_r.table for _r in rollup.ROLLUPS if _r.source == table]
+    placeholders = ", ".join("?" for _ in names)
+    count, last_rowid = con.execute(
+        f"SELECT COUNT(*), MIN(last_rowid) FROM rollup_state"  # nosec B608
+        f" WHERE name IN ({placeholders})",
+        names,
+    ).fetchone()
+    # a rollup that never ran covers nothing
+    return last_rowid if names and count == len(names) else 0
+
+
+def size(con: s3.Connection) -> tuple[int, int]:
+    """Return the size of the database and the bytes of free pages inside it."""
+    page_size = con.execute("PRAGMA page_size;").fetchone()[0]
+    page_count = con.execute("PRAGMA page_count;").fetchone()[0]
+    freelist_count = con.execute("PRAGMA freelist_count;").fetchone()[0]
+    return page_count * page_size, freelist_count * page_size
+
+
+def compact(  # pylint: disable=too-many-positional-arguments
+    db: kimdb.Database,
+    table: str,
+    days: int,
+    batch_rows: int,
+    pause: float = 0.0,
+    stop: Callable[[], bool] | None = None,
+) -> int:
+    """Delete the raw samples of `table` that are older than `days` and rolled up.
+
+    Args:
+        db: the database
+        table: name of the table with the samples
+        days: number of days of raw samples to keep; 0 keeps all
+        batch_rows: number of samples to delete per transaction
+        pause: seconds to wait between the batches, so other writers get a turn
+        stop: called between the batches; return True to stop early
+
+    Returns:
+        number of samples deleted
+    """
+    if days <= 0:
+        return 0
+    first = cutoff(days, time.time())
+    max_rowid = db.execute(lambda con: rolled_up(con, table))
+    sql = batch_query(table)
+    deleted = 0
+    while stop is None or not stop():
+        count = db.execute(lambda con: con.execute(sql, (first, max_rowid, batch_rows)).rowcount)
+        deleted += count
+        if count < batch_rows:
+            break
+        time.sleep(pause)
+    LOGGER.debug(f"Deleted {deleted} samples before {first} from {table}")
+    return deleted
+
+
+def vacuum(db: kimdb.Database, pages: int, stop: Callable[[], bool] | None = None) -> bool:
+    """Give the free pages of the database back to the filesystem, `pages` at a time.
+
+    Args:
+        db: the database
+        pages: number of pages to free per transaction
+        stop: called between the transactions; return True to stop early
+
+    Returns:
+        False if the database does not have auto_vacuum=INCREMENTAL
+    """
+    mode = db.execute(lambda con: con.execute("PRAGMA auto_vacuum;").fetchone()[0])
+    if mode != AUTO_VACUUM_INCREMENTAL:
+        return False
+    while (stop is None or not stop()) and db.execute(lambda con: size(con)[1]):
+        # every row of the result is a freed page; all rows must be fetched
+        db.execute(lambda con: con.execute(f"PRAGMA incremental_vacuum({pages});").fetchall())
+    return True
+
+
+def apply(db: kimdb.Database, policy: dict, stop: Callable[[], bool] | None = None) -> dict:
+    """Bring the rollups up to date, compact the old samples of every table and vacuum.
+
+    Args:
+        db: the database
+        policy: days of raw samples to keep per table ("raw_days"), "batch_rows",
+                "batch_pause" and "vacuum_pages"; see constants.RETENTION
+        stop: called between the batches; return True to stop early
+
+    Returns:
+        samples deleted per table and the size of the database before and after
+    """
+    before, _ = db.execute(size)
+    # samples that are not rolled up yet are never deleted
+    db.execute(rollup.catch_up)
+    deleted = {
+        _table: compact(db, _table, _days, policy["batch_rows"], policy["batch_pause"], stop)
+        for _table, _days in policy["raw_days"].items()
+    }
+    vacuumed = vacuum(db, policy["vacuum_pages"], stop)
+    after, free = db.execute(size)
+    report = {"deleted": deleted, "before": before, "after": after, "free": free}
+    summary = ", ".join(f"{_n} from {_t}" for _t, _n in deleted.items())
+    LOGGER.info(
+        f"Retention: deleted {summary} samples; {before / 1024**2:.1f} MiB ->"
+        f" {after / 1024**2:.1f} MiB, saved {(before - after) / 1024**2:.1f} MiB"
+    )
+    if free and not vacuumed:
+        LOGGER.info(
+            f"Retention: {free / 1024**2:.1f} MiB of free pages are reused but not given back;"
+            f" run retention.py --convert once to enable auto_vacuum=INCREMENTAL"
+        )
+    return report
+
+
+def convert(db: kimdb.Database) -> None:
+    """Switch the database to auto_vacuum=INCREMENTAL; this rebuilds the whole file."""
+
+    def _convert(con: s3.Connection) -> None:
+        con.execute(f"PRAGMA auto_vacuum={AUTO_VACUUM_INCREMENTAL};")
+        # VACUUM can not run inside a transaction
+        con.commit()
+        con.execute("VACUUM;")
+
+    before, _ = db.execute(size)
+    db.execute(_convert)
+    after, _ = db.execute(size)
+    LOGGER.info(
+        f"Converted to auto_vacuum=INCREMENTAL; {before / 1024**2:.1f} MiB ->"
+        f" {after / 1024**2:.1f} MiB"
+    )
+
+
+def check(directory: str, days: int = 10) -> list[str]:
+    """Compact a database with synthetic samples and report the rollup buckets that changed.
+
+    Two databases get the same samples, including samples that arrive late for
+    a compacted day. One of them is compacted before the late samples arrive.
+    Its rollups must equal those of the other, which keeps all raw samples.
+
+    Args:
+        directory: directory to create the databases in
+        days: number of days of raw samples to keep
+
+    Returns:
+        a description of every bucket that differs
+    """
+    rng = random.Random(42)
+    now = time.time()
+    first = cutoff(days, now) - days * DAY
+    samples: dict[str, list[tuple]] = {}
+    late: dict[str, list[tuple]] = {}
+    for table, columns in rollup.COLUMNS.items():
+        # the BT devices report fractional epochs
+        step = 600.5 if table == "data" else 300
+        epochs = [first + _i * step for _i in range(int((now - first) / step))]
+        epochs = epochs + [cutoff(days, now) - days // 2 * DAY + 1234.5]
+        rows = [
+            ("", _e, _r, *(rng.randint(0, 40) for _ in columns))
+            for _e in epochs
+            for _r in ("0.1", "1.1")
+        ]
+        samples[table], late[table] = rows[:-2], rows[-2:]
+    databases = {}
+    deleted = 0
+    for name in ("compacted", "reference"):
+        database = os.path.join(directory, f"{name}.sqlite3")
+        with contextlib.closing(s3.connect(database)) as con:
+            kimdb.create_schema(con)
+        db = databases[name] = kimdb.Database(database)
+        for table, rows in samples.items():
+            db.execute(lambda con, t=table, r=rows: con.executemany(insert_query(t), r))
+        db.execute(rollup.catch_up)
+        if name == "compacted":
+            deleted = sum(compact(db, _t, days, 1000) for _t in rollup.COLUMNS)
+        for table, rows in late.items():
+            db.execute(lambda con, t=table, r=rows: con.executemany(insert_query(t), r))
+        db.execute(rollup.catch_up)
+    problems = [] if deleted else ["nothing was compacted"]
+    for summary in rollup.ROLLUPS:
+        sql = f"SELECT * FROM {summary.table} ORDER BY room_id, sample_epoch"  # nosec B608
+        compacted, reference = (
+            _db.execute(lambda con, s=sql: con.execute(s).fetchall())
+            for _db in databases.values()
+        )
+        if len(compacted) != len(reference):
+            problems.append(f"{summary.table}: {len(compacted)} != {len(reference)} buckets")
+        problems += [
+            f"{summary.table}: {_c} != {_r}"
+            for _c, _r in zip(compacted, reference, strict=False)
+            if not all(_a == _b or math.isclose(_a, _b) for _a, _b in zip(_c, _r, strict=True))
+        ]
+    for db in databases.values():
+        db.close()
+    return problems
+
+
+def insert_query(table: str) -> str:
+    """Return the statement that inserts a sample into `table`."""
+    columns = ", ".join(rollup.COLUMNS[table])
+    placeholders = ", ".join("?" for _ in rollup.COLUMNS[table])
+    return (
+        f"INSERT INTO {table} (sample_time, sample_epoch, room_id, {columns})"  # nosec B608
+        f" VALUES (?, ?, ?, {placeholders})"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact the raw samples older than N days.")
+    parser.add_argument("database", nargs="?", help="database to compact (default: kimnaty's)")
+    parser.add_argument("--days", type=int, help="days of raw samples to keep in every table")
+    parser.add_argument("--convert", action="store_true", help="enable incremental vacuum")
+    parser.add_argument(
+        "--check", action="store_true", help="check the rollups of a compacted test database"
+    )
+    OPTION = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if OPTION.check:
+        with tempfile.TemporaryDirectory(prefix="kimnaty-retention-") as _directory:
+            _problems = check(_directory)
+        for _problem in _problems:
+            print(f"Rollup changed by compaction: {_problem}")
+        if _problems:
+            sys.exit(1)
+        print("Compaction keeps the rollups intact.")
+        sys.exit(0)
+    _db = kimdb.Database(OPTION.database or constants.KIMNATY["database"])
+    try:
+        if OPTION.convert:
+            convert(_db)
+        _policy = dict(constants.RETENTION)
+        if OPTION.days is not None:
+            _policy["raw_days"] = {_t: OPTION.days for _t in _policy["raw_days"]}
+        apply(_db, _policy)
+    finally:
+        _db.close()
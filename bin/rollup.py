@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# kimnaty
+# Copyright (C) 2024  Maurice (mausy5043) Hendrix
+# AGPL-3.0-or-later  - see LICENSE
+
+"""Maintain hourly and daily rollups of the `data` and `aircon` tables.
+
+A rollup table holds the count, sum, minimum and maximum of every numeric
+column per room per bucket. The rollups are brought up to date by a catch-up
+pass that adds the rows added since the previous pass to their buckets. New
+rows are found by their rowid, so samples that arrive late (e.g. from the
+spool) still end up in the right bucket.
+
+Buckets are never recomputed from the raw samples: retention.py deletes the
+raw samples once they are rolled up, and a bucket recomputed from what is left
+would lose them.
+"""
+
+import logging
+import sqlite3 as s3
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+# numeric columns of the source tables
+COLUMNS: dict[str, list[str]] = {
+    "data": ["temperature", "humidity", "voltage"],
+    "aircon": [
+        "ac_power",
+        "ac_mode",
+        "temperature_ac",
+        "temperature_target",
+        "temperature_outside",
+        "cmp_freq",
+    ],
+}
+# aggregates kept per column; the rollup column is named f"{column}_{aggregate}"
+AGGREGATES: dict[str, str] = {"n": "COUNT", "sum": "SUM", "min": "MIN", "max": "MAX"}
+
+SQL_STATE = (
+    "CREATE TABLE IF NOT EXISTS rollup_state ("
+    "name TEXT NOT NULL PRIMARY KEY, last_rowid INTEGER NOT NULL DEFAULT 0)"
+)
+
+
+class Rollup:
+    """Rollup of one source table into buckets of a fixed number of seconds.
+
+    Buckets are aligned to multiples of `bucket` seconds since the epoch (UTC).
+    """
+
+    def __init__(self, source: str, suffix: str, bucket: int) -> None:
+        """Initialise the rollup.
+
+        Args:
+            source: name of the table with the samples
+            suffix: suffix of the name of the rollup table, e.g. 'hourly'
+            bucket: number of seconds per bucket
+        """
+        self.source: str = source
+        self.table: str = f"{source}_{suffix}"
+        self.bucket: int = bucket
+        self.columns: list[str] = COLUMNS[source]
+
+    def create_sql(self) -> str:
+        """Return the statement that creates the rollup table if it does not exist."""
+        columns = "".join(
+            f",\n    {_c}_{_a} {'integer' if _a == 'n' else 'real'}"
+            for _c in self.columns
+            for _a in AGGREGATES
+        )
+        return (
+            f"CREATE TABLE IF NOT EXISTS {self.table} (\n"
+            f"    room_id integer NOT NULL,\n"
+            f"    sample_epoch integer NOT NULL{columns},\n"
+            f"    PRIMARY KEY (room_id, sample_epoch)\n"
+            f"    ) WITHOUT ROWID;"
+        )
+
+    def names(self) -> str:
+        """Return the names of the aggregate columns of the rollup table."""
+        return ", ".join(f"{_c}_{_a}" for _c in self.columns for _a in AGGREGATES)
+
+    def bucket_sql(self) -> str:
+        """Return the expression for the first epoch of the bucket of `sample_epoch`."""
+        # the BT devices report fractional epochs; those need an integer division too
+        return f"(CAST(sample_epoch AS INTEGER) / {self.bucket} * {self.bucket})"
+
+    def merge_sql(self, select: str) -> str:
+        """Return the statement that adds the aggregates that `select` returns to the buckets.
+
+        `select` must return the room_id, the first epoch of the bucket and the
+        aggregates in the order of `names()`. Buckets that do not exist yet are
+        created; the counts and sums of existing buckets are added to and their
+        minimum and maximum are widened.
+        """
+        updates = []
+        for column in self.columns:
+            for aggregate, function in AGGREGATES.items():
+                name = f"{column}_{aggregate}"
+                if aggregate == "n":
+                    updates.append(f"{name} = {name} + excluded.{name}")
+                    continue
+                if aggregate == "sum":
+                    combined = f"{name} + excluded.{name}"
+                else:
+                    combined = f"{function}({name}, excluded.{name})"
+                # either may be NULL if a column has no values in a bucket
+                updates.append(f"{name} = COALESCE({combined}, {name}, excluded.{name})")
+        return (
+            f"INSERT INTO {self.table} (room_id, sample_epoch, {self.names()}) {select}"  # nosec B608
+            f" ON CONFLICT (room_id, sample_epoch) DO UPDATE SET {', '.join(updates)}"
+        )
+
+    def catch_up(self, con: s3.Connection) -> int:
+        """Add the samples that arrived since the previous pass to their buckets.
+
+        Must be called inside a transaction.
+
+        Args:
+            con: connection to the database
+
+        Returns:
+            number of buckets written
+        """
+        row = con.execute(
+            "SELECT last_rowid FROM rollup_state WHERE name = ?", (self.table,)
+        ).fetchone()
+        last_rowid = row[0] if row else 0
+        top_rowid = con.execute(f"SELECT MAX(rowid) FROM {self.source}").fetchone()[0]  # nosec B608
+        if top_rowid is None or top_rowid <= last_rowid:
+            return 0
+        aggregates = ", ".join(f"{_f}({_c})" for _c in self.columns for _f in AGGREGATES.values())
+        cursor = con.execute(
+            self.merge_sql(
+                f"SELECT room_id, {self.bucket_sql()}, {aggregates}"  # nosec B608
+                f" FROM {self.source} WHERE rowid > ? AND rowid <= ?"
+                f" GROUP BY room_id, {self.bucket_sql()}"
+            ),
+            (last_rowid, top_rowid),
+        )
+        con.execute(
+            "INSERT OR REPLACE INTO rollup_state (name, last_rowid) VALUES (?, ?)",
+            (self.table, top_rowid),
+        )
+        return cursor.rowcount
+
+
+ROLLUPS: list[Rollup] = [
+    Rollup("data", "hourly", 3600),
+    Rollup("data", "daily", 86400),
+    Rollup("aircon", "hourly", 3600),
+    Rollup("aircon", "daily", 86400),
+]
+
+
+def pick(source: str, seconds: int) -> Rollup | None:
+    """Return the coarsest rollup of `source` whose buckets fit in `seconds`.
+
+    Args:
+        source: name of the table with the samples
+        seconds: length of the requested aggregation
+
+    Returns:
+        the rollup, or None if no rollup divides `seconds` evenly
+    """
+    fits = [_r for _r in ROLLUPS if _r.source == source and seconds % _r.bucket == 0]
+    return max(fits, key=lambda _r: _r.bucket, default=None)
+
+
+def catch_up(con: s3.Connection) -> dict[str, int]:
+    """Create missing rollup tables and bring all rollups up to date in one transaction.
+
+    Args:
+        con: connection to the database; it must not be in a transaction
+
+    Returns:
+        number of buckets written per rollup table
+    """
+    written: dict[str, int] = {}
+    # take the write lock now, so the rowids and the samples are read consistently
+    con.execute("BEGIN IMMEDIATE;")
+    try:
+        con.execute(SQL_STATE)
+        for rollup in ROLLUPS:
+            con.execute(rollup.create_sql())
+            written[rollup.table] = rollup.catch_up(con)
+        con.commit()
+    except s3.Error:
+        con.rollback()
+        raise
+    return written
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+# kimnaty
+# Copyright (C) 2024  Maurice (mausy5043) Hendrix
+# AGPL-3.0-or-later  - see LICENSE
+
+"""Run periodic and one-shot tasks from a heap of deadlines.
+
+The scheduler sleeps until the earliest deadline. Every task runs in its own
+thread, so a slow task only delays itself and never the other tasks.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections.abc import Callable
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+
+class Task:
+    """A job and the statistics of how well it kept to its schedule."""
+
+    def __init__(
+        self, name: str, func: Callable[[], None], interval: float = 0.0, phase: float = 0.0
+    ) -> None:
+        """Initialise a task.
+
+        Args:
+            name: unique name of the task
+            func: callable to execute
+            interval: seconds between runs; 0.0 for a one-shot task
+            phase: offset [s] of the runs from the multiples of `interval`
+        """
+        self.name: str = name
+        self.func: Callable[[], None] = func
+        self.interval: float = interval
+        self.phase: float = phase
+        self.thread: threading.Thread | None = None
+        self.runs: int = 0
+        self.skipped: int = 0
+        self.drift_sum: float = 0.0
+        self.drift_max: float = 0.0
+        self.duration_max: float = 0.0
+
+    def next_deadline(self, now: float) -> float:
+        """Return the first multiple of the task's interval (plus phase) after `now`."""
+        return self.interval + now - ((now - self.phase) % self.interval)
+
+    def is_running(self) -> bool:
+        """Return True if a previous run of the task has not finished yet."""
+        return self.thread is not None and self.thread.is_alive()
+
+
+class Scheduler:
+    """Execute tasks at their deadlines until stopped."""
+
+    def __init__(
+        self,
+        on_run: Callable[[Task, float, float], None] | None = None,
+        on_skip: Callable[[Task], None] | None = None,
+    ) -> None:
+        """Initialise an empty schedule.
+
+        Args:
+            on_run: called with the task, how late it was started [s] and how long it
+                ran [s] after every run, e.g. to export metrics
+            on_skip: called with the task when a run is skipped because the previous
+                run had not finished
+        """
+        self.on_run: Callable[[Task, float, float], None] | None = on_run
+        self.on_skip: Callable[[Task], None] | None = on_skip
+        self.tasks: dict[str, Task] = {}
+        self._heap: list[tuple[float, int, Task]] = []
+        self._counter = itertools.count()
+        # re-entrant, because stop() may be called from a signal handler
+        self._cond = threading.Condition(threading.RLock())
+        self._stopped: bool = False
+        self._error: Exception | None = None
+
+    def every(  # pylint: disable=too-many-positional-arguments
+        self,
+        name: str,
+        interval: float,
+        func: Callable[[], None],
+        start: float | None = None,
+        phase: float = 0.0,
+    ) -> Task:
+        """Run `func` every `interval` seconds.
+
+        Runs are aligned to multiples of `interval` since the epoch, shifted by `phase`.
+
+        Args:
+            name: unique name of the task
+            interval: seconds between runs
+            func: callable to execute
+            start: epoch of the first run (default: next aligned deadline)
+            phase: offset [s] of the runs from the multiples of `interval`
+
+        Returns:
+            the scheduled task
+        """
+        task = Task(name, func, interval, phase)
+        self.tasks[name] = task
+        if start is None:
+            start = task.next_deadline(time.time())
+        self._push(start, task)
+        return task
+
+    def at(self, name: str, when: float, func: Callable[[], None]) -> Task:
+        """Run `func` once at epoch `when`.
+
+        Re-using the name of an earlier one-shot task keeps its statistics.
+
+        Args:
+            name: name of the task
+            when: epoch of the run
+            func: callable to execute
+
+        Returns:
+            the scheduled task
+        """
+        task = self.tasks.get(name)
+        if task is None or task.interval:
+            task = Task(name, func)
+            self.tasks[name] = task
+        task.func = func
+        self._push(when, task)
+        return task
+
+    def stop(self) -> None:
+        """Stop the scheduler. Tasks that are running are allowed to finish."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    @property
+    def stopped(self) -> bool:
+        """Return True once the scheduler was stopped."""
+        return self._stopped
+
+    def run(self) -> None:
+        """Execute tasks at their deadlines until `stop()` is called.
+
+        Raises:
+            Exception: the first exception raised by a task; it also stops the scheduler.
+        """
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    wait: float | None = None
+                    if self._heap:
+                        wait = self._heap[0][0] - time.time()
+                        if wait <= 0.0:
+                            break
+                    self._cond.wait(wait)
+                if self._stopped:
+                    break
+                deadline, _, task = heapq.heappop(self._heap)
+            self._launch(task, deadline)
+        self.join()
+        self.log_drift()
+        if self._error is not None:
+            raise self._error
+
+    def join(self, timeout: float | None = None) -> None:
+        """Wait for all running tasks to finish."""
+        for task in list(self.tasks.values()):
+            if task.thread is not None:
+                task.thread.join(timeout)
+
+    def log_drift(self) -> None:
+        """Log how late each task was started and how long it ran."""
+        for task in self.tasks.values():
+            mean_drift = task.drift_sum / task.runs if task.runs else 0.0
+            LOGGER.info(
+                f"{task.name:<16}: {task.runs} runs, {task.skipped} skipped; "
+                f"drift mean {mean_drift:.3f}s max {task.drift_max:.3f}s; "
+                f"duration max {task.duration_max:.1f}s"
+            )
+
+    def _push(self, deadline: float, task: Task) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._counter), task))
+            self._cond.notify_all()
+
+    def _launch(self, task: Task, deadline: float) -> None:
+        now = time.time()
+        if task.interval:
+            self._push(task.next_deadline(now), task)
+        if task.is_running():
+            task.skipped += 1
+            LOGGER.warning(f"{task.name} is still running; skipping this run")
+            if self.on_skip is not None:
+                self.on_skip(task)
+            return
+        drift = now - deadline
+        task.runs += 1
+        task.drift_sum += drift
+        task.drift_max = max(task.drift_max, drift)
+        LOGGER.debug(f"starting {task.name} ({drift:.3f}s late)")
+        task.thread = threading.Thread(
+            target=self._execute, args=(task, drift), name=task.name, daemon=True
+        )
+        task.thread.start()
+
+    def _execute(self, task: Task, drift: float) -> None:
+        t0 = time.time()
+        try:
+            task.func()
+        except Exception as her:  # pylint: disable=W0703
+            LOGGER.critical(f"*** Task {task.name} failed: {type(her).__name__} {her}")
+            with self._cond:
+                if self._error is None:
+                    self._error = her
+            self.stop()
+        finally:
+            duration = time.time() - t0
+            task.duration_max = max(task.duration_max, duration)
+            if self.on_run is not None:
+                self.on_run(task, drift, duration)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# kimnaty
+# Copyright (C) 2024  Maurice (mausy5043) Hendrix
+# AGPL-3.0-or-later  - see LICENSE
+
+"""Keep samples on disk while the database can not store them.
+
+Every table has its own append-only journal with one JSON object per line.
+Draining moves the journal aside first, so samples that arrive while the
+spooled samples are being stored end up in a fresh journal.
+"""
+
+import json
+import logging
+import os
+import threading
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+
+class Spool:
+    """Durable, line-delimited journals of samples; one per table."""
+
+    def __init__(self, directory: str) -> None:
+        """Initialise the spool.
+
+        Args:
+            directory: directory to keep the journals in; created if needed
+        """
+        self.directory: str = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _journal(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.jsonl")
+
+    def append(self, name: str, records: list[dict]) -> None:
+        """Append records to the journal of table `name` and sync it to disk.
+
+        Args:
+            name: name of the table the records belong to
+            records: records to keep
+        """
+        if not records:
+            return
+        lines = "".join(f"{json.dumps(record, separators=(',', ':'))}\n" for record in records)
+        with self._lock, open(self._journal(name), "a", encoding="utf-8") as journal:
+            journal.write(lines)
+            journal.flush()
+            os.fsync(journal.fileno())
+        LOGGER.warning(f"Spooled {len(records)} records for {name}")
+
+    def pending(self, name: str) -> int:
+        """Return the number of records waiting in the journals of table `name`."""
+        count = 0
+        with self._lock:
+            for path in (self._journal(name), f"{self._journal(name)}.draining"):
+                if os.path.isfile(path):
+                    with open(path, encoding="utf-8") as journal:
+                        count += sum(1 for line in journal if line.strip())
+        return count
+
+    def drain(self, name: str) -> list[dict]:
+        """Return all spooled records of table `name`.
+
+        The records stay on disk until `commit()` is called. A journal left
+        behind by an interrupted drain is returned as well.
+
+        Args:
+            name: name of the table
+
+        Returns:
+            list of records
+        """
+        journal = self._journal(name)
+        draining = f"{journal}.draining"
+        records: list[dict] = []
+        with self._lock:
+            if os.path.isfile(journal):
+                if os.path.isfile(draining):
+                    # an earlier drain was interrupted; merge both journals
+                    with open(journal, encoding="utf-8") as src:
+                        content = src.read()
+                    with open(draining, "a", encoding="utf-8") as dst:
+                        dst.write(content)
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                    os.remove(journal)
+                else:
+                    os.replace(journal, draining)
+            if not os.path.isfile(draining):
+                return records
+            with open(draining, encoding="utf-8") as src:
+                for line_nr, line in enumerate(src, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # a partially written last line after a power failure
+                        LOGGER.error(f"Skipping corrupt line {line_nr} in {draining}")
+        return records
+
+    def commit(self, name: str) -> None:
+        """Forget the records returned by the last `drain()` of table `name`."""
+        with self._lock:
+            draining = f"{self._journal(name)}.draining"
+            if os.path.isfile(draining):
+                os.remove(draining)
@@ -14,7 +14,8 @@ CREATE TABLE data (
 
 CREATE INDEX idx_data_time ON data(sample_time);
 CREATE INDEX idx_data_epoch ON data(sample_epoch);
-CREATE INDEX idx_data_room ON data(room_id);
+-- serves queries for a range of epochs of a list of rooms
+CREATE INDEX idx_data_room_epoch ON data(room_id, sample_epoch);
 
 
 -- TABLE rooms is used to link room_id with human-readable room names
@@ -60,4 +61,111 @@ CREATE TABLE aircon (
 
 CREATE INDEX idx_ac_time ON aircon(sample_time);
 CREATE INDEX idx_ac_epoch ON aircon(sample_epoch);
-CREATE INDEX idx_ac_room ON aircon(room_id);
+-- serves queries for a range of epochs of a list of rooms
+CREATE INDEX idx_ac_room_epoch ON aircon(room_id, sample_epoch);
+
+
+-- Rollups of the tables data and aircon per hour and per day (UTC).
+-- Every numeric column has a count, sum, minimum and maximum per room per bucket.
+-- They are kept up to date by the catch-up pass in rollup.py;
+-- TABLE rollup_state remembers the last rowid of the source table that was rolled up.
+CREATE TABLE rollup_state (
+    name        text NOT NULL PRIMARY KEY,
+    last_rowid  integer NOT NULL DEFAULT 0
+    );
+
+CREATE TABLE data_hourly (
+    room_id         integer NOT NULL,
+    sample_epoch    integer NOT NULL,
+    temperature_n   integer,
+    temperature_sum real,
+    temperature_min real,
+    temperature_max real,
+    humidity_n      integer,
+    humidity_sum    real,
+    humidity_min    real,
+    humidity_max    real,
+    voltage_n       integer,
+    voltage_sum     real,
+    voltage_min     real,
+    voltage_max     real,
+    PRIMARY KEY (room_id, sample_epoch)
+    ) WITHOUT ROWID;
+
+CREATE TABLE data_daily (
+    room_id         integer NOT NULL,
+    sample_epoch    integer NOT NULL,
+    temperature_n   integer,
+    temperature_sum real,
+    temperature_min real,
+    temperature_max real,
+    humidity_n      integer,
+    humidity_sum    real,
+    humidity_min    real,
+    humidity_max    real,
+    voltage_n       integer,
+    voltage_sum     real,
+    voltage_min     real,
+    voltage_max     real,
+    PRIMARY KEY (room_id, sample_epoch)
+    ) WITHOUT ROWID;
+
+CREATE TABLE aircon_hourly (
+    room_id                 integer NOT NULL,
+    sample_epoch            integer NOT NULL,
+    ac_power_n              integer,
+    ac_power_sum            real,
+    ac_power_min            real,
+    ac_power_max            real,
+    ac_mode_n               integer,
+    ac_mode_sum             real,
+    ac_mode_min             real,
+    ac_mode_max             real,
+    temperature_ac_n        integer,
+    temperature_ac_sum      real,
+    temperature_ac_min      real,
+    temperature_ac_max      real,
+    temperature_target_n    integer,
+    temperature_target_sum  real,
+    temperature_target_min  real,
+    temperature_target_max  real,
+    temperature_outside_n   integer,
+    temperature_outside_sum real,
+    temperature_outside_min real,
+    temperature_outside_max real,
+    cmp_freq_n              integer,
+    cmp_freq_sum            real,
+    cmp_freq_min            real,
+    cmp_freq_max            real,
+    PRIMARY KEY (room_id, sample_epoch)
+    ) WITHOUT ROWID;
+
+CREATE TABLE aircon_daily (
+    room_id                 integer NOT NULL,
+    sample_epoch            integer NOT NULL,
+    ac_power_n              integer,
+    ac_power_sum            real,
+    ac_power_min            real,
+    ac_power_max            real,
+    ac_mode_n               integer,
+    ac_mode_sum             real,
+    ac_mode_min             real,
+    ac_mode_max             real,
+    temperature_ac_n        integer,
+    temperature_ac_sum      real,
+    temperature_ac_min      real,
+    temperature_ac_max      real,
+    temperature_target_n    integer,
+    temperature_target_sum  real,
+    temperature_target_min  real,
+    temperature_target_max  real,
+    temperature_outside_n   integer,
+    temperature_outside_sum real,
+    temperature_outside_min real,
+    temperature_outside_max real,
+    cmp_freq_n              integer,
+    cmp_freq_sum            real,
+    cmp_freq_min            real,
+    cmp_freq_max            real,
+    PRIMARY KEY (room_id, sample_epoch)
+    ) WITHOUT ROWID;
@@ -7,6 +7,9 @@
 """Create graphs of the data for various periods."""
 
 import argparse
+import contextlib
+import cProfile
+import functools
 import json
 import random
 import sqlite3 as s3
@@ -16,9 +19,14 @@ import warnings
 from datetime import datetime as dt
 
 import constants
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+import queries
+import rollup
+import trendcache
+import trendplot
+import trendprofile
+from pandas.tseries.frequencies import to_offset
 
 # UserWarning: Could not infer format, so each element will be parsed individually,
 # falling back to `dateutil`. To ensure parsing is consistent and as-expected,
@@ -28,13 +36,6 @@ import pandas as pd
 #         )
 warnings.simplefilter(action="ignore", category=UserWarning)
 
-DATABASE = constants.TREND["database"]
-TABLE_RHT = constants.TREND["sql_table_rht"]
-TABLE_AC = constants.TREND["sql_table_ac"]
-ROOMS = constants.ROOMS
-DEVICE_LIST = constants.DEVICES
-AIRCO_LIST = constants.AIRCO
-
 # fmt: off
 parser = argparse.ArgumentParser(description="Create a trendgraph")
 parser.add_argument("-hr", "--hours", type=int, help="create hour-trend for last <HOURS> hours")
@@ -42,14 +43,44 @@ parser.add_argument("-d", "--days", type=int, help="create day-trend for last <D
 parser.add_argument("-m", "--months", type=int, help="number of months of data to use for the graph")
 parser.add_argument("-e", "--edate", type=str, help="date of last day of the graph (default: now)")
 parser.add_argument("-o", "--outside", action="store_true", help="plot outside temperature")
+parser.add_argument("--nocache", action="store_true", help="do not use the caches of the previous run; render all graphs")
 parser.add_argument("--devlist", type=str, help="quoted python list of device-ids to show; example: \'[\"1.1\", \"0.1\"]\'")
+parser.add_argument("--profile", type=str, help="write the time, rows and bytes of every stage as JSON to this file (- for stdout)")
+parser.add_argument("--cprofile", type=str, help="write cProfile statistics of the run to this file")
+parser.add_argument("--all", action="store_true", help="create the hour-, day- and month-trend from one pass over the data")
 parser_group = parser.add_mutually_exclusive_group(required=False)
 parser_group.add_argument("--debug", action="store_true", help="start in debugging mode")
-OPTION = parser.parse_args()
+# other modules that import this one (e.g. trendapi.py) get the defaults
+OPTION = parser.parse_args(None if __name__ == "__main__" else [])
 # fmt: on
 
+DATABASE = constants.TREND["database"]
+TABLE_RHT = constants.TREND["sql_table_rht"]
+TABLE_AC = constants.TREND["sql_table_ac"]
+ROOMS = constants.ROOMS
+DEVICE_LIST = constants.DEVICES
+AIRCO_LIST = constants.AIRCO
+
 DEBUG = False
 EDATETIME = "'now'"
+# samples of the previous run; only used for graphs that end 'now'
+CACHE: trendcache.SampleCache | None = None
+# fingerprints of the rendered graphs; unchanged graphs are not rendered again
+FINGERPRINTS: trendplot.Fingerprints | None = None
+# measurements of the stages of the run; enabled by --profile
+PROFILE = trendprofile.Profiler()
+TIMEZONE = "Europe/Amsterdam"
+# file and title of the graphs of each trend
+GRAPHS = {
+    "hours": ("day_graph", " trend afgelopen dagen"),
+    "days": ("month_graph", " trend per uur afgelopen maand"),
+    "months": ("year_graph", " trend per dag afgelopen maanden"),
+}
+# aggregation per datapoint of each trend
+RESOLUTION = {"hours": "2min", "days": "h", "months": "6h"}
+# numeric columns of the tables; these are averaged when aggregating
+COLUMNS_RHT = rollup.COLUMNS["data"]
+COLUMNS_AC = rollup.COLUMNS["aircon"]
 
 
 def prune(objects: list) -> list:
@@ -61,10 +92,114 @@ def prune(objects: list) -> list:
     return return_objects
 
 
-def fetch_data(hours_to_fetch: int = 48, aggregation: str = "10min") -> dict:
-    """..."""
-    data_dict_rht = fetch_data_rht(hours_to_fetch=hours_to_fetch, aggregation=aggregation)
-    data_dict_ac = fetch_data_ac(hours_to_fetch=hours_to_fetch, aggregation=aggregation)
+def fetch_data(
+    hours_to_fetch: int = 48,
+    aggregation: str = "10min",
+    in_sql: bool = False,
+    rollups: bool = False,
+) -> dict:
+    """Fetch the data of all BT devices and aircos.
+
+    Args:
+        hours_to_fetch: number of hours of data to fetch
+        aggregation: pandas frequency string of the aggregation per datapoint
+        in_sql: let SQLite compute the means per `aggregation` instead of pandas,
+                so only the aggregated rows are transferred
+        rollups: compute the means from the hourly or daily rollup tables if their
+                 buckets fit `aggregation`; otherwise behave as `in_sql`. The daemon
+                 keeps the rollups up to date; they lag the samples by up to `rollup_time`
+
+    Returns:
+        dict with a DataFrame per parameter
+    """
+    rooms_rht, rooms_ac = fetch_tables(hours_to_fetch, aggregation, in_sql, rollups)
+    return graph_data(rooms_rht, rooms_ac, aggregation)
+
+
+def fetch_tables(
+    hours_to_fetch: int, aggregation: str, in_sql: bool = False, rollups: bool = False
+) -> tuple[dict, dict]:
+    """Fetch the data of all BT devices and aircos without laying it out for the graphs.
+
+    The arguments are those of `fetch_data()`.
+
+    Returns:
+        a DataFrame per BT device and a DataFrame per airco
+    """
+    bucket = 0
+    if in_sql or rollups:
+        bucket = to_offset(aggregation).nanos // 10**9
+    # one connection serves all queries
+    with contextlib.closing(s3.connect(DATABASE)) as con:
+        rooms_rht = fetch_table(con, TABLE_RHT, rht_ids(), hours_to_fetch, bucket, rollups)
+        rooms_ac = fetch_table(con, TABLE_AC, ac_ids(), hours_to_fetch, bucket, rollups)
+    return rooms_rht, rooms_ac
+
+
+def fetch_all(hours: int, days: int, months: int) -> dict[str, dict]:
+    """Fetch the data for the hour, day and month trends in one pass.
+
+    The hour trend needs the raw samples. The day and month trends are both
+    derived from the hourly rollups of the longest period, which are read once.
+
+    Args:
+        hours: number of hours of the hour trend
+        days: number of days of the day trend
+        months: number of months of the month trend
+
+    Returns:
+        dict with the data of each trend, keyed like GRAPHS
+    """
+    periods = {"days": days * 24, "months": months * 31 * 24}
+    with contextlib.closing(s3.connect(DATABASE)) as con:
+        raw_rht = fetch_table(con, TABLE_RHT, rht_ids(), hours)
+        raw_ac = fetch_table(con, TABLE_AC, ac_ids(), hours)
+        longest = max(periods.values())
+        hourly_rht = fetch_rooms(
+            con, TABLE_RHT, rht_ids(), longest, COLUMNS_RHT, 3600, rollup.pick(TABLE_RHT, 3600)
+        )
+        hourly_ac = fetch_rooms(
+            con, TABLE_AC, ac_ids(), longest, COLUMNS_AC, 3600, rollup.pick(TABLE_AC, 3600)
+        )
+        firsts = {_p: queries.epoch_range(con, EDATETIME, _h)[0] for _p, _h in periods.items()}
+    graphs = {"hours": graph_data(raw_rht, raw_ac, RESOLUTION["hours"])}
+    for period, first in firsts.items():
+        start = pd.Timestamp(first, unit="s", tz="UTC")
+        bucket = to_offset(RESOLUTION[period]).nanos // 10**9
+        rooms_rht = rollups_means(
+            {_r: _df[_df.index >= start] for _r, _df in hourly_rht.items()}, COLUMNS_RHT, bucket
+        )
+        rooms_ac = rollups_means(
+            {_r: _df[_df.index >= start] for _r, _df in hourly_ac.items()}, COLUMNS_AC, bucket
+        )
+        graphs[period] = graph_data(rooms_rht, rooms_ac, RESOLUTION[period])
+    return graphs
+
+
+def rht_ids() -> list[str]:
+    """Return the room_ids of the BT devices to trend."""
+    return [_d["room_id"] for _d in DEVICE_LIST]
+
+
+def ac_ids() -> list[str]:
+    """Return the names of the aircos to trend."""
+    return [_a["name"] for _a in AIRCO_LIST]
+
+
+def graph_data(rooms_rht: dict, rooms_ac: dict, aggregation: str) -> dict:
+    """Lay the data of the rooms out for the graphs.
+
+    Args:
+        rooms_rht: DataFrame per BT device
+        rooms_ac: DataFrame per airco
+        aggregation: pandas frequency string of the aggregation per datapoint
+
+    Returns:
+        dict with a DataFrame per parameter
+    """
+    with PROFILE.stage("layout"):
+        data_dict_rht = process_rht(rooms_rht, aggregation)
+        data_dict_ac = process_ac(rooms_ac, aggregation)
     data_dict = {}
     # move outside temperature from Daikin to the table with the other temperature sensors
     #     for d in data_dict_ac:
@@ -87,103 +222,199 @@ def fetch_data(hours_to_fetch: int = 48, aggregation: str = "10min") -> dict:
     return data_dict
 
 
-def fetch_data_ac(hours_to_fetch: int = 48, aggregation: str = "10min") -> dict:
-    """
-    Query the database to fetch the requested data
-    :param hours_to_fetch:      (int) number of hours of data to fetch
-    :param aggregation:         (int) number of minutes to aggregate per datapoint
-    :return:
+def fetch_table(  # pylint: disable=too-many-positional-arguments
+    con: s3.Connection,
+    table: str,
+    room_ids: list[str],
+    hours_to_fetch: int,
+    bucket: int = 0,
+    rollups: bool = False,
+) -> dict[str, pd.DataFrame]:
+    """Fetch the data of the rooms in `table`.
+
+    Args:
+        con: connection to the database
+        table: name of the table to query
+        room_ids: rooms to fetch
+        hours_to_fetch: number of hours of data to fetch
+        bucket: seconds per mean computed by SQLite; 0 for raw samples
+        rollups: compute the means from a rollup if one fits `bucket`
+
+    Returns:
+        dict with a DataFrame per room_id
     """
-    df = pd.DataFrame()
-    df_cmp = pd.DataFrame()
-    df_t = pd.DataFrame()
+    columns = rollup.COLUMNS[table]
+    summary = rollup.pick(table, bucket) if rollups and bucket else None
+    rooms = fetch_rooms(con, table, room_ids, hours_to_fetch, columns, bucket, summary)
+    if summary is not None:
+        rooms = rollups_means(rooms, columns, bucket)
+    return rooms
+
+
+def read_sql(con: s3.Connection, s3_query: str, params: list) -> pd.DataFrame:
+    """Run a query and return the result; wait while the database is locked."""
     if DEBUG:
-        print("*** fetching AC ***")
-    for airco in AIRCO_LIST:
-        airco_id = airco["name"]
-        where_condition = (
-            f" ( sample_time >= datetime({EDATETIME}, '-{hours_to_fetch + 1} hours')"
-            f" AND sample_time <= datetime({EDATETIME}, '+2 hours') )"
-            f" AND (room_id LIKE '{airco_id}')"
-        )
-        s3_query = f"SELECT * FROM {TABLE_AC} WHERE {where_condition}"  # nosec B608
-        if DEBUG:
-            print(s3_query)
-        # Get the data
-        success = False
-        retries = 5
-        while not success and retries > 0:
-            try:
-                with s3.connect(DATABASE) as con:
-                    df = pd.read_sql_query(
-                        s3_query, con, parse_dates=["sample_time"], index_col="sample_epoch"
-                    )
-                    success = True
-            except (s3.OperationalError, pd.errors.DatabaseError) as exc:
-                if DEBUG:
-                    print("Database may be locked. Waiting...")
-                retries -= 1
-                time.sleep(random.randint(30, 60))  # nosec bandit B311
-                if retries == 0:
-                    raise TimeoutError("Database seems locked.") from exc
+        print(s3_query, params)
+    df = pd.DataFrame()
+    success = False
+    retries = 5
+    while not success and retries > 0:
+        try:
+            df = pd.read_sql_query(s3_query, con, params=params)
+            success = True
+        except (s3.OperationalError, pd.errors.DatabaseError) as exc:
+            if DEBUG:
+                print("Database may be locked. Waiting...")
+            retries -= 1
+            time.sleep(random.randint(30, 60))  # nosec bandit B311
+            if retries == 0:
+                raise TimeoutError("Database seems locked.") from exc
+    return df
+
+
+def fetch_rooms(  # pylint: disable=too-many-positional-arguments
+    con: s3.Connection,
+    table: str,
+    room_ids: list[str],
+    hours_to_fetch: int,
+    columns: list[str],
+    bucket: int = 0,
+    summary: rollup.Rollup | None = None,
+) -> dict[str, pd.DataFrame]:
+    """Fetch the samples of the last `hours_to_fetch` hours of all requested rooms.
+
+    See `query_rooms()` for the other arguments and the result.
+    """
+    first, last = queries.epoch_range(con, EDATETIME, hours_to_fetch)
+    return query_rooms(con, table, room_ids, first, last, columns, bucket, summary)
+
+
+def query_rooms(  # pylint: disable=too-many-positional-arguments
+    con: s3.Connection,
+    table: str,
+    room_ids: list[str],
+    first: int,
+    last: int,
+    columns: list[str],
+    bucket: int = 0,
+    summary: rollup.Rollup | None = None,
+) -> dict[str, pd.DataFrame]:
+    """Fetch the samples of all requested rooms from `table` in one query.
 
+    Raw samples are taken from the cache (if enabled) and only the newer rows are
+    read from the database.
+
+    Args:
+        con: connection to the database
+        table: name of the table to query
+        room_ids: rooms to fetch
+        first: epoch of the first sample to fetch
+        last: epoch of the last sample to fetch
+        columns: numeric columns to fetch
+        bucket: if not 0, return the mean of `columns` per `bucket` seconds per room
+                instead of the individual samples
+        summary: rollup to compute the means per `bucket` from; its buckets must fit
+
+    Returns:
+        dict with a DataFrame per room_id, indexed by localised sample time.
+        Rooms without samples get an empty DataFrame. For a `summary` the frames
+        hold the sums, counts, minima and maxima of its buckets (see `rollup_means()`).
+    """
+    with PROFILE.stage("query", table=table) as record:
+        if CACHE is not None and not bucket and summary is None:
+            df = CACHE.fetch(con, table, room_ids, columns, first, last, read_sql)
+            df = df.drop(columns="rowid")
+        else:
+            offset = 0
+            if bucket and summary is None:
+                # align the buckets to local time like pandas does. The current UTC offset
+                # is used for all samples, so across a DST change buckets >1h are shifted
+                # by an hour.
+                utcoffset = pd.Timestamp.now(tz=TIMEZONE).utcoffset() or pd.Timedelta(0)
+                offset = int(utcoffset.total_seconds())
+            s3_query = queries.rooms_query(table, columns, len(room_ids), bucket, offset, summary)
+            df = read_sql(con, s3_query, [*room_ids, first, last])
+            # map the stored room_id back to the requested one
+            df["room_id"] = df["room_id"].map({queries.stored_room_id(_r): _r for _r in room_ids})
+        PROFILE.count(record, df)
+    with PROFILE.stage("convert", table=table) as record:
+        df = df.set_index("sample_epoch")
+        room_id = df.pop("room_id")
         for c in df.columns:
-            if c not in ["sample_time"]:
-                df[c] = pd.to_numeric(df[c], errors="coerce")
-        df.index = (
-            pd.to_datetime(df.index, unit="s").tz_localize("UTC").tz_convert("Europe/Amsterdam")
-        )
-        df.drop("sample_time", axis=1, inplace=True, errors="ignore")
-        # resample to monotonic timeline
-        df = df.resample(f"{aggregation}").mean(numeric_only=True)
-        df = df.interpolate()
-        # remove temperature target values for samples when the AC is turned off.
-        df.loc[df.ac_power == 0, "temperature_target"] = np.nan
-        # conserve memory; we dont need these anymore.
-        df.drop(["ac_mode", "ac_power", "room_id"], axis=1, inplace=True, errors="ignore")
-        df_cmp = collate(
-            df_cmp,
-            df,
-            columns_to_drop=["temperature_ac", "temperature_target", "temperature_outside"],
-            column_to_rename="cmp_freq",
-            new_name=airco_id,
+            df[c] = pd.to_numeric(df[c], errors="coerce")
+        df.index = pd.to_datetime(df.index, unit="s").tz_localize("UTC").tz_convert(TIMEZONE)
+        rooms = {str(_r): _df for _r, _df in df.groupby(room_id.to_numpy(), sort=False)}
+        PROFILE.count(record, df)
+    return {_r: rooms.get(_r, df.iloc[0:0]) for _r in room_ids}
+
+
+def rollups_means(rooms: dict, columns: list[str], bucket: int) -> dict[str, pd.DataFrame]:
+    """Apply `rollup_means()` to the sums and counts of every room."""
+    means = {}
+    for room_id, df in rooms.items():
+        with PROFILE.stage("rollup_means", room=room_id) as record:
+            means[room_id] = rollup_means(df, columns, bucket)
+            PROFILE.count(record, means[room_id])
+    return means
+
+
+def rollup_means(df: pd.DataFrame, columns: list[str], bucket: int) -> pd.DataFrame:
+    """Combine the rollup buckets into the means, minima and maxima per `bucket` seconds.
+
+    Args:
+        df: sums, counts, minima and maxima of one room, indexed by localised bucket time
+        columns: names of the columns
+        bucket: seconds per mean; a multiple of the rollup's bucket
+
+    Returns:
+        DataFrame with the means of `columns` and their minima and maxima as
+        f"{column}_min" and f"{column}_max"
+    """
+    buckets = df.resample(pd.Timedelta(seconds=bucket))
+    totals = buckets.sum()
+    lows = buckets.min()
+    highs = buckets.max()
+    data = {}
+    for column in columns:
+        data[column] = totals[f"{column}_sum"] / totals[f"{column}_n"].where(
+            totals[f"{column}_n"] > 0
         )
-        if df_t.empty:
-            df1 = collate(
-                None,
-                df,
-                columns_to_drop=["cmp_freq", "temperature_outside"],
-                column_to_rename="temperature_ac",
-                new_name=airco_id,
-            )
-            df_t = collate(
-                df_t,
-                df1,
-                columns_to_drop=[],
-                column_to_rename="temperature_target",
-                new_name=f"{airco_id}_tgt",
-            )
-        else:
-            df2 = collate(
-                None,
-                df,
-                columns_to_drop=["cmp_freq"],
-                column_to_rename="temperature_ac",
-                new_name=airco_id,
-            )
-            df_t = collate(
-                df_t,
-                df2,
-                columns_to_drop=[],
-                column_to_rename="temperature_target",
-                new_name=f"{airco_id}_tgt",
-            )
-
-    # create a new column containing the max value of both aircos, then remove the airco_ columns
-    df_cmp["cmp_freq"] = df_cmp[["airco0", "airco1"]].apply(np.max, axis=1)
-    df_cmp.drop(["airco0", "airco1"], axis=1, inplace=True, errors="ignore")
-    # if DEBUG:
-    #     print(df_cmp)
+        data[f"{column}_min"] = lows[f"{column}_min"]
+        data[f"{column}_max"] = highs[f"{column}_max"]
+    return pd.DataFrame(data, index=totals.index)
+
+
+def process_ac(rooms: dict, aggregation: str = "10min") -> dict:
+    """
+    Lay out the data of the aircos for the graphs
+    :param rooms:               (dict) DataFrame per airco
+    :param aggregation:         (int) number of minutes to aggregate per datapoint
+    :return:
+    """
+    if DEBUG:
+        print("*** processing AC ***")
+    airco_ids = list(rooms)
+    wide = pivot_rooms(rooms, aggregation, COLUMNS_AC + envelope_columns(rooms, COLUMNS_AC))
+    # remove temperature target values for samples when the AC is turned off.
+    df_tgt = wide["temperature_target"].mask(wide["ac_power"] == 0).add_suffix("_tgt")
+    df_t = pd.concat([with_envelope(wide, "temperature_ac"), df_tgt], axis=1)
+    df_t = df_t[
+        [
+            _c
+            for _a in airco_ids
+            for _c in (_a, *(f"{_a}{_s}" for _s in trendplot.ENVELOPE), f"{_a}_tgt")
+            if _c in df_t
+        ]
+    ]
+    # all aircos report the same outside temperature; use the one of the last airco
+    if airco_ids:
+        df_t["temperature_outside"] = wide["temperature_outside"][airco_ids[-1]]
+    # the compressor graph shows the highest frequency of all aircos
+    df_cmp = wide["cmp_freq"].max(axis=1).to_frame("cmp_freq")
+    if "cmp_freq_max" in wide:
+        # the highest minimum of the aircos is a lower bound of the minimum of the highest
+        df_cmp["cmp_freq_min"] = wide["cmp_freq_min"].max(axis=1)
+        df_cmp["cmp_freq_max"] = wide["cmp_freq_max"].max(axis=1)
     # rename the column to something shorter or drop it
     if OPTION.outside:
         df_t.rename(columns={"temperature_outside": "T(out)"}, inplace=True)
@@ -196,176 +427,145 @@ def fetch_data_ac(hours_to_fetch: int = 48, aggregation: str = "10min") -> dict:
     return ac_data_dict
 
 
-def fetch_data_rht(hours_to_fetch: int = 48, aggregation: str = "10min") -> dict:
+def process_rht(rooms: dict, aggregation: str = "10min") -> dict:
     """
-    Query the database to fetch the requested data
-    :param hours_to_fetch:      (int) number of hours of data to fetch
+    Lay out the data of the BT devices for the graphs
+    :param rooms:               (dict) DataFrame per BT device
     :param aggregation:         (int) number of minutes to aggregate per datapoint
     :return:
     """
-    df = pd.DataFrame()
     if DEBUG:
-        print("*** fetching RHT ***")
-    df_t = pd.DataFrame()
-    df_h = pd.DataFrame()
-    df_v = pd.DataFrame()
-    for device in DEVICE_LIST:
-        room_id = device["room_id"]
-        where_condition = (
-            f" ( sample_time >= datetime({EDATETIME}, '-{hours_to_fetch + 1} hours')"
-            f" AND sample_time <= datetime({EDATETIME}, '+2 hours') )"
-            f" AND (room_id LIKE '{room_id}')"
-        )
-        s3_query = f"SELECT * FROM {TABLE_RHT} WHERE {where_condition}"  # nosec B608
-        if DEBUG:
-            print(s3_query)
-        # Get the data
-        success = False
-        retries = 5
-        while not success and retries > 0:
-            try:
-                with s3.connect(DATABASE) as con:
-                    df = pd.read_sql_query(
-                        s3_query, con, parse_dates=["sample_time"], index_col="sample_epoch"
-                    )
-                    success = True
-            except (s3.OperationalError, pd.errors.DatabaseError) as exc:
-                if DEBUG:
-                    print("Database may be locked. Waiting...")
-                retries -= 1
-                time.sleep(random.randint(30, 60))  # nosec bandit B311
-                if retries == 0:
-                    raise TimeoutError("Database seems locked.") from exc
-
-        # conserve memory; we dont need the room_id repeated in every row.
-        df.drop("room_id", axis=1, inplace=True, errors="ignore")
-        for c in df.columns:
-            if c not in ["sample_time"]:
-                df[c] = pd.to_numeric(df[c], errors="coerce")
-        df.index = (
-            pd.to_datetime(df.index, unit="s").tz_localize("UTC").tz_convert("Europe/Amsterdam")
-        )
-        # resample to monotonic timeline
-        df = df.resample(f"{aggregation}").mean(numeric_only=True)
-        df = df.interpolate()
-        try:
-            new_name = ROOMS[room_id]
-        except KeyError:
-            new_name = room_id
-        df.drop("sample_time", axis=1, inplace=True, errors="ignore")
-        # if DEBUG:
-        #     print(df)
-        df_t = collate(
-            df_t,
-            df,
-            columns_to_drop=["voltage", "humidity"],
-            column_to_rename="temperature",
-            new_name=new_name,
-        )
-
-        df_h = collate(
-            df_h,
-            df,
-            columns_to_drop=["temperature", "voltage"],
-            column_to_rename="humidity",
-            new_name=new_name,
-        )
-
-        df_v = collate(
-            df_v,
-            df,
-            columns_to_drop=["temperature", "humidity"],
-            column_to_rename="voltage",
-            new_name=new_name,
-        )
-
-    if DEBUG:
-        print(f"TEMPERATURE\n{df_t.head()}")
-        print(f"TEMPERATURE\n{df_t.tail()}")
-    #     print(f"HUMIDITY\n{df_h}")
-    #     print(f"VOLTAGE\n{df_v}")
+        print("*** processing RHT ***")
+    wide = pivot_rooms(rooms, aggregation, COLUMNS_RHT + envelope_columns(rooms, COLUMNS_RHT))
+    names = {_r: ROOMS.get(_r, _r) for _r in rooms}
     rht_data_dict: dict[str, pd.DataFrame] = {
-        "temperature": df_t,
-        "humidity": df_h,
-        "voltage": df_v,
+        _c: with_envelope(wide, _c, names) for _c in ["temperature", "humidity", "voltage"]
     }
+    if DEBUG:
+        print(f"TEMPERATURE\n{rht_data_dict['temperature'].head()}")
+        print(f"TEMPERATURE\n{rht_data_dict['temperature'].tail()}")
     return rht_data_dict
 
 
-def collate(
-    prev_df: pd.DataFrame | None,
-    data_frame: pd.DataFrame,
-    columns_to_drop: list,
-    column_to_rename: str,
-    new_name: str = "room_id",
+def envelope_columns(rooms: dict, columns: list[str]) -> list[str]:
+    """Return the columns with the minima and maxima of `columns` that the rooms hold.
+
+    Only the means per bucket of SQLite and of the rollups come with their minima
+    and maxima; the raw samples do not.
+    """
+    if not rooms:
+        return []
+    present = next(iter(rooms.values())).columns
+    return [f"{_c}{_s}" for _c in columns for _s in trendplot.ENVELOPE if f"{_c}{_s}" in present]
+
+
+def with_envelope(
+    wide: dict[str, pd.DataFrame], column: str, names: dict | None = None
 ) -> pd.DataFrame:
-    # drop the 'columns_to_drop'
-    if not columns_to_drop:
-        columns_to_drop = []
-    for col in columns_to_drop:
-        data_frame = data_frame.drop(col, axis=1, errors="ignore")
-    # rename the 'column_to_rename'
-    data_frame.rename(columns={f"{column_to_rename}": new_name}, inplace=True)
-    # if DEBUG:
-    #     print()
-    #     print(new_name)
-    #     print(data_frame)
-    # collate both dataframes
-    if prev_df is not None:
-        data_frame = pd.merge(prev_df, data_frame, left_index=True, right_index=True, how="outer")
-    # if DEBUG:
-    #     print(data_frame)
-    return data_frame
-
-
-def plot_graph(output_file: str, data_dict: dict, plot_title: str) -> None:
-    """Plot the data into a graph
+    """Return the DataFrame of `column` followed by its minima and maxima, if any.
 
     Args:
-        output_file (str): (str) name of the trendgraph file
-        data_dict (dict): contains the data for the lines.
-                          Each parameter is a separate pandas Dataframe
-                          e.g. {'df': Dataframe}
-        plot_title (str): title to be displayed above the plot
+        wide: a DataFrame per column as returned by `pivot_rooms()`
+        column: the column to return
+        names: new names of the rooms
+
+    Returns:
+        DataFrame with a column per room and a column per room and suffix in
+        trendplot.ENVELOPE, which trendplot draws as a band around the room
+    """
+    names = names or {}
+    frames = [wide[column].rename(columns=names)]
+    for suffix in trendplot.ENVELOPE:
+        if f"{column}{suffix}" in wide:
+            frames.append(wide[f"{column}{suffix}"].rename(columns=names).add_suffix(suffix))
+    return pd.concat(frames, axis=1)
+
+
+def pivot_rooms(rooms: dict, aggregation: str, columns: list[str]) -> dict:
+    """
+    Resample the data of every room and lay it out side by side
+    :param rooms:               (dict) DataFrame per room
+    :param aggregation:         (str) pandas frequency string of the aggregation per datapoint
+    :param columns:             (list) columns of the room DataFrames
+    :return: dict with a DataFrame per column, with a column per room on the union of
+             the timelines of all rooms
+    """
+    if not rooms:
+        return {_c: pd.DataFrame() for _c in columns}
+    frames = []
+    for room_id, df in rooms.items():
+        with PROFILE.stage("resample", room=room_id) as record:
+            # resample to monotonic timeline; each room keeps its own first and last datapoint
+            frames.append(df.resample(aggregation).mean(numeric_only=True).interpolate())
+            PROFILE.count(record, frames[-1])
+    with PROFILE.stage("pivot") as record:
+        # the union of the timelines, and where the datapoints of each room go in it
+        index = functools.reduce(pd.Index.union, [_df.index for _df in frames])
+        positions = [index.searchsorted(_df.index) for _df in frames]
+        data_dict = {}
+        for column in columns:
+            # rooms without samples keep a column of NaNs
+            values = np.full((len(index), len(frames)), np.nan, order="F")
+            for room_nr, (rows, df) in enumerate(zip(positions, frames, strict=True)):
+                values[rows, room_nr] = df[column].to_numpy(dtype=float)
+            data_dict[column] = pd.DataFrame(values, index=index, columns=list(rooms))
+            PROFILE.count(record, data_dict[column])
+    return data_dict
+
+
+def completed(data_frame: pd.DataFrame, aggregation: str) -> pd.DataFrame:
+    """Return the rows of `data_frame` whose bucket of `aggregation` has ended.
+
+    Args:
+        data_frame: data of a graph, indexed by the localised start of every bucket
+        aggregation: pandas frequency string of the aggregation per datapoint
+
+    Returns:
+        the rows of the buckets that end before now
+    """
+    if not isinstance(data_frame.index, pd.DatetimeIndex):
+        # no rooms, so no timeline
+        return data_frame
+    ends = data_frame.index + pd.Timedelta(to_offset(aggregation).nanos, unit="ns")
+    return data_frame[ends <= pd.Timestamp.now(tz=TIMEZONE)]
+
+
+def plot_graphs(graphs: dict[str, dict]) -> None:
+    """Plot the data of the trends into their graphs.
+
+    Args:
+        graphs: for each trend (see GRAPHS) a dict with a DataFrame per parameter.
+                Each parameter is plotted in a separate graph. Graphs whose completed
+                buckets did not change since the previous run are not rendered again.
     Returns:
         None
     """
     if DEBUG:
         print("*** plotting ***")
-    for parameter_name in data_dict:
-        parameter = str(parameter_name)
-        if DEBUG:
-            print(parameter)
-        data_frame = data_dict[parameter]
-        fig_x = 20
-        fig_y = 7.5
-        fig_fontsize = 13
-        ahpla = 0.7
-
-        # ###############################
-        # Create a line plot of temperatures
-        # ###############################
-
-        plt.rc("font", size=fig_fontsize)
-        ax1 = data_frame.plot(kind="line", marker=".", figsize=(fig_x, fig_y))
-        # linewidth and alpha need to be set separately
-        for _, _l in enumerate(ax1.lines):  # pylint: disable=W0612
-            plt.setp(_l, alpha=ahpla, linewidth=1, linestyle=" ")
-        ax1.set_ylabel(parameter)
-        if parameter == "temperature_ac":
-            ax1.set_ylim((12.0, 28.0))
-        if parameter == "voltage":
-            ax1.set_ylim((2.2, 3.3))
-        ax1.legend(loc="lower left", ncol=8, framealpha=0.2)
-        ax1.set_xlabel("Datetime")
-        ax1.grid(which="major", axis="y", color="k", linestyle="--", linewidth=0.5)
-        plt.title(f"{parameter} {plot_title}")
-        plt.tight_layout()
-        plt.savefig(
-            fname=f"{output_file}_{parameter}.png",
-            format="png",
-            # bbox_inches='tight'
-        )
+    now = dt.now().strftime("%d-%m-%Y %H:%M:%S")
+    jobs = []
+    skipped = 0
+    for period, data_dict in graphs.items():
+        graph, title = GRAPHS[period]
+        for parameter, data_frame in data_dict.items():
+            if DEBUG:
+                print(parameter)
+            output_file = f"{constants.TREND[graph]}_{parameter}.png"
+            plot_title = f"{parameter} {title}"
+            # the last bucket changes with every sample until it ends; leave it out
+            if FINGERPRINTS is not None and not FINGERPRINTS.changed(
+                output_file, str(parameter), completed(data_frame, RESOLUTION[period]), plot_title
+            ):
+                skipped += 1
+                continue
+            jobs.append((output_file, str(parameter), data_frame, f"{plot_title} ({now})"))
+    with PROFILE.stage("render_all"):
+        rendered = trendplot.plot_all(jobs, constants.TREND["max_workers"])
+    for stats in rendered:
+        PROFILE.add({"stage": "render", **stats})
+    if FINGERPRINTS is not None:
+        FINGERPRINTS.save()
+    print(f"Rendered {len(jobs)} graphs; skipped {skipped} graphs with unchanged data")
 
 
 def main() -> None:
@@ -373,36 +573,25 @@ def main() -> None:
     This is the main loop
     """
     try:
-        if OPTION.hours:
-            # aggr = int(float(OPTION.hours) * 60. / 480.)
-            # if aggr < 1:
-            #     aggr = 1
-            aggr = "2min"
-            plot_graph(
-                constants.TREND["day_graph"],
-                fetch_data(hours_to_fetch=OPTION.hours, aggregation=aggr),
-                f" trend afgelopen dagen ({dt.now().strftime('%d-%m-%Y %H:%M:%S')})",
-            )
-        if OPTION.days:
-            # aggr = int(float(OPTION.days) * 24. * 60. / 5760.)
-            # if aggr < 1:
-            #     aggr = 30
-            aggr = "h"
-            plot_graph(
-                constants.TREND["month_graph"],
-                fetch_data(hours_to_fetch=OPTION.days * 24, aggregation=aggr),
-                f" trend per uur afgelopen maand ({dt.now().strftime('%d-%m-%Y %H:%M:%S')})",
-            )
-        if OPTION.months:
-            # aggr = int(float(OPTION.months) * 30.5 * 24. * 60. / 9900.)
-            # if aggr < 1:
-            #     aggr = 30
-            aggr = "6h"
-            plot_graph(
-                constants.TREND["year_graph"],
-                fetch_data(hours_to_fetch=OPTION.months * 31 * 24, aggregation=aggr),
-                f" trend per dag afgelopen maanden ({dt.now().strftime('%d-%m-%Y %H:%M:%S')})",
-            )
+        if OPTION.all:
+            graphs = fetch_all(OPTION.hours, OPTION.days, OPTION.months)
+        else:
+            graphs = {}
+            if OPTION.hours:
+                graphs["hours"] = fetch_data(
+                    hours_to_fetch=OPTION.hours, aggregation=RESOLUTION["hours"]
+                )
+            if OPTION.days:
+                graphs["days"] = fetch_data(
+                    hours_to_fetch=OPTION.days * 24, aggregation=RESOLUTION["days"], rollups=True
+                )
+            if OPTION.months:
+                graphs["months"] = fetch_data(
+                    hours_to_fetch=OPTION.months * 31 * 24,
+                    aggregation=RESOLUTION["months"],
+                    rollups=True,
+                )
+        plot_graphs(graphs)
     except pd.errors.DatabaseError:
         # Database is locked let it go...
         print("Failing due to database error (locked?)")
@@ -416,6 +605,11 @@ if __name__ == "__main__":
 
     print(f"Trending with Python {sys.version}")
 
+    if OPTION.all:
+        # trends that were not given on the command line use the defaults
+        for _period in GRAPHS:
+            if getattr(OPTION, _period) is None:
+                setattr(OPTION, _period, 0)
     # use hardcoded default if CLI value is 0
     if OPTION.hours == 0:
         OPTION.hours = constants.TREND["option_hours"]
@@ -432,6 +626,20 @@ if __name__ == "__main__":
     if OPTION.edate:
         print("NOT NOW")
         EDATETIME = f"'{OPTION.edate}'"
+    elif not OPTION.nocache:
+        CACHE = trendcache.SampleCache(constants.TREND["cache_dir"])
+    if not OPTION.nocache:
+        FINGERPRINTS = trendplot.Fingerprints(f"{constants.TREND['cache_dir']}/graphs.json")
+    if OPTION.profile:
+        PROFILE.enabled = True
     if OPTION.debug:
         print(OPTION)
-    main()
+    if OPTION.cprofile:
+        # the graphs that are rendered in worker processes are not included
+        _cprofile = cProfile.Profile()
+        _cprofile.runcall(main)
+        _cprofile.dump_stats(OPTION.cprofile)
+    else:
+        main()
+    if OPTION.profile:
+        PROFILE.report(OPTION.profile)
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+
+# kimnaty
+# Copyright (C) 2024  Maurice (mausy5043) Hendrix
+# AGPL-3.0-or-later  - see LICENSE
+
+"""Serve the samples of the rooms and the aircos over HTTP, read-only.
+
+The series are fetched with the queries of trend.py. A period that holds more
+than `points` datapoints is averaged into buckets, so no series is ever longer
+than the `max_points` of constants.API. Buckets of whole hours are computed from
+the rollups, which the daemon keeps up to date every `rollup_time` seconds.
+Periods that start before the retention period of the raw samples (see
+retention.py) always use the rollups.
+
+Requests:
+    GET /api                lists the rooms and columns of every table
+    GET /api/rht            temperature, humidity and voltage of the BT devices
+    GET /api/ac             the samples of the aircos
+with these optional parameters:
+    rooms=1.1,0.1           rooms or aircos to return (default: all)
+    columns=temperature     columns to return (default: all)
+    start=<epoch>           start of the period (default: `option_hours` before `end`)
+    end=<epoch>             end of the period (default: now)
+    points=<n>              maximum number of datapoints per series
+    format=json|bin         response format (default: json)
+
+The JSON response holds per room the epochs of the datapoints in "time" and a
+list of values (or null) per column. The binary response starts with the same
+document without the lists, terminated by a newline. It is followed, per room in
+the order of the document, by `length` little-endian int64 epochs and then
+`length` little-endian float32 values (NaN if missing) per column.
+
+Responses carry an ETag and a Last-Modified header that only change when the
+samples in the period change, so browsers and proxies can cache them, e.g.:
+    python3 trendapi.py --port 9151
+    curl 'http://127.0.0.1:9151/api/rht?rooms=1.1&columns=temperature&points=500'
+"""
+
+import argparse
+import contextlib
+import email.utils
+import hashlib
+import http.server
+import json
+import logging
+import math
+import sqlite3 as s3
+import time
+import urllib.parse
+from typing import TypedDict, cast
+
+import constants
+import numpy as np
+import pandas as pd
+import queries
+import retention
+import rollup
+import trend
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+# the tables that can be requested and the ids of their rooms
+TABLES = {
+    "rht": (trend.TABLE_RHT, trend.rht_ids),
+    "ac": (trend.TABLE_AC, trend.ac_ids),
+}
+# seconds per datapoint to choose from; longer periods use a multiple of a day
+BUCKETS = [60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400]
+FORMATS = {"json": "application/json", "bin": "application/octet-stream"}
+# decimals of the values in the JSON response; the sensors are not more precise
+DECIMALS = 3
+
+
+class Request(TypedDict):
+    """The normalised parameters of a request for a series; see `parse_request()`."""
+
+    table: str
+    room_ids: list[str]
+    columns: list[str]
+    first: int
+    last: int
+    bucket: int
+    format: str
+
+
+def choose_bucket(span: int, points: int) -> int:
+    """Return the shortest bucket that fits a period of `span` seconds in `points` datapoints.
+
+    The first and the last bucket may be partly outside the period, hence the +1.
+    """
+    for bucket in BUCKETS:
+        if math.ceil(span / bucket) + 1 <= points:
+            return bucket
+    days = max(1, math.ceil(span / (points - 1) / 86400))
+    while math.ceil(span / (days * 86400)) + 1 > points:
+        days += 1
+    return days * 86400
+
+
+def parse_request(path: str, now: float) -> Request:
+    """Return the normalised parameters of a request for a series.
+
+    The period is widened to whole buckets, so the same request gives the same
+    parameters (and ETag) until the next bucket starts.
+
+    Args:
+        path: path and query string of the request, e.g. /api/rht?rooms=1.1
+        now: epoch to use if no end is given
+
+    Returns:
+        the table, room_ids, columns, first and last epoch, bucket and format
+
+    Raises:
+        KeyError: the path is not a table
+        ValueError: a parameter is not valid
+    """
+    url = urllib.parse.urlsplit(path)
+    table, ids = TABLES[url.path.removeprefix("/api/").strip("/")]
+    params = {_k: _v[-1] for _k, _v in urllib.parse.parse_qs(url.query).items()}
+    known_ids = ids()
+    room_ids = params["rooms"].split(",") if "rooms" in params else known_ids
+    columns = params["columns"].split(",") if "columns" in params else rollup.COLUMNS[table]
+    unknown = [_r for _r in room_ids if _r not in known_ids]
+    unknown += [_c for _c in columns if _c not in rollup.COLUMNS[table]]
+    if unknown or not room_ids or not columns:
+        raise ValueError(f"unknown rooms or columns: {', '.join(unknown)}")
+    end = int(params.get("end", now))
+    start = int(params.get("start", end - constants.TREND["option_hours"] * 3600))
+    points = min(
+        int(params.get("points", constants.API["default_points"])), constants.API["max_points"]
+    )
+    if start >= end or points < 2:
+        raise ValueError("need start < end and at least 2 points")
+    fmt = params.get("format", "json")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    bucket = choose_bucket(end - start, points)
+    days = constants.RETENTION["raw_days"][table]
+    if days and start < retention.cutoff(days, now):
+        # only the rollups hold samples this old
+        bucket = max(bucket, 3600)
+    return {
+        "table": table,
+        "room_ids": room_ids,
+        "columns": columns,
+        "first": start - start % bucket,
+        "last": end - end % bucket + bucket - 1,
+        "bucket": bucket,
+        "format": fmt,
+    }
+
+
+def window_state(con: s3.Connection, request: Request) -> tuple[int, int | None, int, bool]:
+    """Return what the response to `request` is made of, to validate cached responses.
+
+    A response from the rollups only includes the samples that the rollups caught
+    up with, which lag the samples by up to `rollup_time`.
+
+    Returns:
+        the number of samples in the period, the epoch of the last one, the highest
+        rowid of the samples in the response and whether that includes all samples
+    """
+    count, latest, top_rowid = con.execute(
+        queries.window_query(request["table"], len(request["room_ids"])),
+        [*request["room_ids"], request["first"], request["last"]],
+    ).fetchone()
+    top_rowid = top_rowid or 0
+    summary = rollup.pick(request["table"], request["bucket"])
+    if summary is None:
+        return count, latest, top_rowid, True
+    row = con.execute(
+        "SELECT last_rowid FROM rollup_state WHERE name = ?", (summary.table,)
+    ).fetchone()
+    rolled_up = min(top_rowid, row[0] if row else 0)
+    return count, latest, rolled_up, rolled_up == top_rowid
+
+
+def fetch_series(con: s3.Connection, request: Request) -> dict[str, pd.DataFrame]:
+    """Return the means per bucket of the requested columns of every requested room."""
+    table, bucket, columns = request["table"], request["bucket"], request["columns"]
+    summary = rollup.pick(table, bucket)
+    rooms = trend.query_rooms(
+        con,
+        table,
+        request["room_ids"],
+        request["first"],
+        request["last"],
+        columns,
+        bucket,
+        summary,
+    )
+    if summary is not None:
+        rooms = trend.rollups_means(rooms, columns, bucket)
+    return rooms
+
+
+def header(request: Request, rooms: dict[str, pd.DataFrame]) -> dict:
+    """Return the description of the response without the series."""
+    names = trend.ROOMS if request["table"] == trend.TABLE_RHT else {}
+    return {
+        "table": request["table"],
+        "bucket": request["bucket"],
+        "first": request["first"],
+        "last": request["last"],
+        "columns": request["columns"],
+        "rooms": [
+            {"room_id": _r, "name": names.get(_r, _r), "length": len(_df)}
+            for _r, _df in rooms.items()
+        ],
+    }
+
+
+def epochs(df: pd.DataFrame) -> np.ndarray:
+    """Return the index of `df` as epochs."""
+    index = cast(pd.DatetimeIndex, df.index)
+    # converts to UTC
+    return index.to_numpy(dtype="datetime64[s]").astype(np.int64)
+
+
+def to_json(request: Request, rooms: dict[str, pd.DataFrame]) -> bytes:
+    """Return the series as a compact JSON document."""
+    document = header(request, rooms)
+    for room in document["rooms"]:
+        df = rooms[room["room_id"]]
+        room["time"] = epochs(df).tolist()
+        for column in request["columns"]:
+            values = df[column].to_numpy(dtype=float).round(DECIMALS)
+            room[column] = [None if math.isnan(_v) else _v for _v in values.tolist()]
+    return json.dumps(document, separators=(",", ":")).encode()
+
+
+def to_binary(request: Request, rooms: dict[str, pd.DataFrame]) -> bytes:
+    """Return the series as a JSON header followed by the arrays; see the module docstring."""
+    chunks = [json.dumps(header(request, rooms), separators=(",", ":")).encode(), b"\n"]
+    for df in rooms.values():
+        chunks.append(epochs(df).astype("<i8").tobytes())
+        for column in request["columns"]:
+            chunks.append(df[column].to_numpy(dtype="<f4").tobytes())
+    return b"".join(chunks)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Answer the requests for the series."""
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        self.respond(send_body=True)
+
+    def do_HEAD(self) -> None:  # pylint: disable=invalid-name
+        self.respond(send_body=False)
+
+    def respond(self, send_body: bool) -> None:
+        """Send the series (or the list of tables) that the request asks for."""
+        if urllib.parse.urlsplit(self.path).path.rstrip("/") == "/api":
+            self.send(200, FORMATS["json"], json.dumps(index()).encode(), send_body)
+            return
+        try:
+            request = parse_request(self.path, time.time())
+        except KeyError:
+            self.send_error(404)
+            return
+        except ValueError as her:
+            self.send_error(400, explain=str(her))
+            return
+        with contextlib.closing(s3.connect(f"file:{trend.DATABASE}?mode=ro", uri=True)) as con:
+            count, latest, rowid, complete = window_state(con, request)
+            validators = [request, count, latest, rowid, DECIMALS]
+            etag = f'"{hashlib.sha256(json.dumps(validators).encode()).hexdigest()[:32]}"'
+            headers = {
+                "ETag": etag,
+                "Cache-Control": f"max-age={cache_time(request, complete)}",
+            }
+            if not complete:
+                # the response changes when the rollups catch up, not when a sample arrives
+                latest = None
+            if latest is not None:
+                headers["Last-Modified"] = email.utils.formatdate(latest, usegmt=True)
+            if self.not_modified(etag, latest):
+                self.send(304, None, b"", False, headers)
+                return
+            rooms = fetch_series(con, request)
+        body = (to_json if request["format"] == "json" else to_binary)(request, rooms)
+        self.send(200, FORMATS[request["format"]], body, send_body, headers)
+
+    def not_modified(self, etag: str, latest: int | None) -> bool:
+        """Return True if the client already has the response; see RFC 9110, 13.2.2."""
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return if_none_match.strip() == "*" or etag in [
+                _t.strip().removeprefix("W/") for _t in if_none_match.split(",")
+            ]
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is None or latest is None:
+            return False
+        with contextlib.suppress(TypeError, ValueError):
+            # HTTP dates have whole seconds
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            return int(latest) <= since
+        return False
+
+    def send(  # pylint: disable=too-many-positional-arguments
+        self,
+        status: int,
+        content_type: str | None,
+        body: bytes,
+        send_body: bool,
+        headers: dict | None = None,
+    ) -> None:
+        """Send the status, the headers and (unless `send_body` is False) the body."""
+        self.send_response(status)
+        if content_type is not None:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        LOGGER.info(f"{self.address_string()} {format % args}")
+
+
+def cache_time(request: Request, complete: bool) -> int:
+    """Return how many seconds a response may be cached without asking again."""
+    if not complete:
+        # the rollups will catch up within `rollup_time`
+        return 0
+    if request["last"] < time.time() - request["bucket"]:
+        # a period in the past only changes if late samples arrive
+        return 86400
+    # the current bucket changes with every sample
+    return min(request["bucket"], 300)
+
+
+def index() -> dict:
+    """Return the rooms and columns of every table and the maximum number of points."""
+    return {
+        "max_points": constants.API["max_points"],
+        "tables": {
+            _name: {"rooms": ids(), "columns": rollup.COLUMNS[table]}
+            for _name, (table, ids) in TABLES.items()
+        },
+    }
+
+
+def main() -> None:
+    """Serve the API until interrupted."""
+    server = http.server.ThreadingHTTPServer((OPTION.host, OPTION.port), Handler)
+    server.daemon_threads = True
+    LOGGER.info(f"Serving {trend.DATABASE} on http://{OPTION.host}:{OPTION.port}/api")
+    with contextlib.suppress(KeyboardInterrupt):
+        server.serve_forever()
+    server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the samples as JSON or binary.")
+    parser.add_argument("--host", default=constants.API["host"], help="address to listen on")
+    parser.add_argument("--port", type=int, default=constants.API["port"], help="port")
+    parser.add_argument("--debug", action="store_true", help="start in debugging mode")
+    OPTION = parser.parse_args()
+    logging.basicConfig(
+        level=logging.DEBUG if OPTION.debug else logging.INFO,
+        format="%(module)s.%(funcName)s [%(levelname)s] - %(message)s",
+    )
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# kimnaty
+# Copyright (C) 2024  Maurice (mausy5043) Hendrix
+# AGPL-3.0-or-later  - see LICENSE
+
+"""Keep the samples of the last trend graph on disk for the next run.
+
+The samples of a table are stored in a `.npz` file together with the highest
+rowid that was fetched. The next run only fetches the rows added after that
+rowid, appends them and drops the rows that fell out of the window. Rows that
+arrive late (e.g. from the spool) have a higher rowid, so they are picked up
+even if their `sample_epoch` is old.
+"""
+
+import json
+import os
+import sqlite3 as s3
+import zipfile
+from collections.abc import Callable
+
+import numpy as np
+import pandas as pd
+import queries
+
+# bump when the layout of the cache files changes
+VERSION = 1
+
+
+class SampleCache:
+    """Cache of the raw samples of a range of epochs; one file per table."""
+
+    def __init__(self, directory: str) -> None:
+        """Initialise the cache.
+
+        Args:
+            directory: directory to keep the cache files in; created if needed
+        """
+        self.directory: str = directory
+        os.makedirs(directory, exist_ok=True)
+        self.stats: dict[str, int] = {"cached": 0, "fetched": 0}
+
+    def _file(self, table: str) -> str:
+        return os.path.join(self.directory, f"trend_{table}.npz")
+
+    def load(self, table: str) -> tuple[pd.DataFrame | None, dict]:
+        """Return the cached samples of `table` and their metadata.
+
+        Returns:
+            the samples (or None if there is no usable cache file) and the metadata
+        """
+        try:
+            with np.load(self._file(table), allow_pickle=False) as npz:
+                meta = json.loads(str(npz["meta"]))
+                if meta.get("version") != VERSION:
+                    return None, {}
+                data = {
+                    _c: npz[_c] for _c in ["rowid", "room_id", "sample_epoch", *meta["columns"]]
+                }
+        except (OSError, KeyError, ValueError):
+            # missing or damaged; start afresh
+            return None, {}
+        return pd.DataFrame(data), meta
+
+    def save(self, table: str, df: pd.DataFrame, meta: dict) -> None:
+        """Store the samples of `table` and their metadata.
+
+        The file is replaced atomically, so a concurrent run never reads half a file.
+        """
+        path = self._file(table)
+        arrays = {_c: df[_c].to_numpy() for _c in df.columns}
+        arrays["room_id"] = df["room_id"].to_numpy(dtype=str)
+        arrays["meta"] = np.array(json.dumps(meta))
+        # the layout of np.savez(): an uncompressed zip with a .npy file per array
+        with zipfile.ZipFile(f"{path}.tmp", "w", zipfile.ZIP_STORED) as npz:
+            for name, array in arrays.items():
+                with npz.open(f"{name}.npy", "w", force_zip64=True) as member:
+                    np.lib.format.write_array(member, array, allow_pickle=False)
+        os.replace(f"{path}.tmp", path)
+
+    def fetch(  # pylint: disable=too-many-positional-arguments
+        self,
+        con: s3.Connection,
+        table: str,
+        room_ids: list[str],
+        columns: list[str],
+        first: int,
+        last: int,
+        read_sql: Callable[[s3.Connection, str, list], pd.DataFrame],
+    ) -> pd.DataFrame:
+        """Return the samples of `room_ids` from `first` to `last`; fetch only what is new.
+
+        Args:
+            con: connection to the database
+            table: name of the table with the samples
+            room_ids: rooms to fetch
+            columns: numeric columns to fetch
+            first: first epoch to return
+            last: last epoch to return
+            read_sql: callable that runs a query and returns the result as a DataFrame
+
+        Returns:
+            DataFrame with the columns rowid, room_id (as requested), sample_epoch
+            and `columns`
+        """
+        cached, meta = self.load(table)
+        if cached is not None and not self._usable(con, table, room_ids, columns, first, meta):
+            cached = None
+        since = meta["rowid"] if cached is not None else 0
+        sql = queries.new_rows_query(table, columns, len(room_ids))
+        new = read_sql(con, sql, [*room_ids, first, last, since])
+        # store the room_id as requested, not as SQLite stored it
+        new["room_id"] = new["room_id"].map({queries.stored_room_id(_r): _r for _r in room_ids})
+        for c in columns:
+            new[c] = pd.to_numeric(new[c], errors="coerce")
+        if cached is not None:
+            cached = cached[(cached["sample_epoch"] >= first) & (cached["sample_epoch"] <= last)]
+            self.stats["cached"] += len(cached)
+            df = pd.concat([cached, new], ignore_index=True) if len(new) else cached
+        else:
+            df = new
+        self.stats["fetched"] += len(new)
+        meta = {
+            "version": VERSION,
+            "room_ids": room_ids,
+            "columns": columns,
+            "first": first,
+            "rowid": since,
+            "rowid_epoch": meta.get("rowid_epoch") if cached is not None else None,
+        }
+        if len(new):
+            # the watermark never goes back, even if its row dropped out of the window
+            rowids = new["rowid"].to_numpy()
+            top = rowids.argmax()
+            meta["rowid"] = int(rowids[top])
+            meta["rowid_epoch"] = int(new["sample_epoch"].to_numpy()[top])
+        self.save(table, df, meta)
+        return df
+
+    @staticmethod
+    def _usable(  # pylint: disable=too-many-positional-arguments
+        con: s3.Connection,
+        table: str,
+        room_ids: list[str],
+        columns: list[str],
+        first: int,
+        meta: dict,
+    ) -> bool:
+        """Return True if the cached samples can be extended instead of fetched anew."""
+        if meta["room_ids"] != room_ids or meta["columns"] != columns or meta["first"] > first:
+            return False
+        if not meta["rowid"]:
+            return True
+        # a VACUUM may renumber the rows; then the rowid no longer points at the same sample
+        row = con.execute(
+            f"SELECT sample_epoch FROM {table} WHERE rowid = ?",  # nosec B608
+            (meta["rowid"],),
+        ).fetchone()
+        return row is not None and row[0] == meta["rowid_epoch"]
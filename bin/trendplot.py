@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+# kimnaty
+# Copyright (C) 2024  Maurice (mausy5043) Hendrix
+# AGPL-3.0-or-later  - see LICENSE
+
+"""Render the trend graphs to PNG files.
+
+The graphs are drawn on bare `Figure`s with the Agg canvas. They are not
+registered with pyplot, so every figure is freed as soon as its file is saved and
+no GUI backend is ever loaded. Graphs are independent of each other and are
+rendered in parallel by a pool of processes.
+
+A series that has more datapoints than the plot is wide in pixels is decimated
+to the minimum and the maximum of every slice of two pixels. That keeps short
+peaks (that plotting every datapoint would draw over) and bounds the time it takes
+to render a graph, however long the series.
+
+Columns named after another column with the suffixes in ENVELOPE hold the minima
+and maxima of that column per datapoint, e.g. from the rollups. They are drawn as a
+band around the column, so peaks that the means average away remain visible.
+
+A fingerprint of the data and the options behind every graph is kept, so a graph
+is only rendered again when something it shows has changed.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import time
+from typing import Any, cast
+
+import matplotlib as mpl
+import numpy as np
+import pandas as pd
+from matplotlib import dates as mdates
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+FIG_SIZE = (20, 7.5)
+FIG_FONTSIZE = 13
+ALPHA = 0.7
+# columns f"{column}_min" and f"{column}_max" are drawn as a band around `column`
+ENVELOPE = ("_min", "_max")
+ENVELOPE_ALPHA = 0.2
+# fixed ranges of the y-axis for some parameters
+Y_LIMITS: dict[str, tuple[float, float]] = {
+    "temperature_ac": (12.0, 28.0),
+    "voltage": (2.2, 3.3),
+}
+# how series are reduced to the width of the plot; part of the fingerprint of a graph
+DECIMATION = "minmax"
+
+
+def decimate(values: np.ndarray, budget: int) -> np.ndarray:
+    """Return the positions of the values to plot, at most `budget` of them.
+
+    The series is cut into slices of equal length and the positions of the minimum
+    and the maximum of every slice are kept. The first and the last value are kept
+    as well, so the plot still spans the whole series. NaNs are never kept.
+
+    Args:
+        values: the series
+        budget: maximum number of positions to return; at least 4
+
+    Returns:
+        sorted positions in `values`
+    """
+    present = np.flatnonzero(~np.isnan(values))
+    if len(present) <= budget:
+        return present
+    n_slices = (budget - 2) // 2
+    size = -(-len(values) // n_slices)
+    padded = np.full(n_slices * size, np.nan)
+    padded[: len(values)] = values
+    slices = padded.reshape(n_slices, size)
+    valid = ~np.isnan(slices)
+    starts = np.arange(n_slices) * size
+    lows = starts + np.where(valid, slices, np.inf).argmin(axis=1)
+    highs = starts + np.where(valid, slices, -np.inf).argmax(axis=1)
+    # slices of only NaNs have nothing to show
+    keep = valid.any(axis=1)
+    return np.unique(np.concatenate([present[[0, -1]], lows[keep], highs[keep]]))
+
+
+def plot(output_file: str, parameter: str, data_frame: pd.DataFrame, plot_title: str) -> dict:
+    """Plot the columns of `data_frame` as dots against time and save them as PNG.
+
+    Args:
+        output_file: name of the PNG file
+        parameter: name of the parameter; used as label of the y-axis
+        data_frame: data to plot, one line per column, indexed by localised time;
+                    the columns of an envelope (see ENVELOPE) are drawn as a band
+        plot_title: title to be displayed above the plot
+
+    Returns:
+        the name of the PNG file, its size, the number of datapoints plotted and the
+        wall and CPU time it took to render
+    """
+    wall, cpu = time.perf_counter(), time.process_time()
+    with mpl.rc_context({"font.size": FIG_FONTSIZE}):
+        fig = Figure(figsize=FIG_SIZE)
+        FigureCanvasAgg(fig)
+        ax1 = fig.add_subplot()
+        # one datapoint per pixel of the width of the figure
+        budget = int(fig.get_figwidth() * fig.dpi)
+        points = 0
+        # plot the local wall-clock time, not UTC
+        timeline = cast(pd.DatetimeIndex, data_frame.index).tz_localize(None).to_numpy()
+        bands = {
+            _c: [f"{_c}{_s}" for _s in ENVELOPE]
+            for _c in data_frame.columns
+            if all(f"{_c}{_s}" in data_frame.columns for _s in ENVELOPE)
+        }
+        envelopes = {_e for _band in bands.values() for _e in _band}
+        for column in data_frame.columns:
+            if column in envelopes:
+                continue
+            values = data_frame[column].to_numpy(dtype=float)
+            positions = decimate(values, budget)
+            points += len(positions)
+            lines = ax1.plot(
+                timeline[positions],
+                values[positions],
+                marker=".",
+                linestyle="none",
+                alpha=ALPHA,
+                label=str(column),
+            )
+            if column not in bands:
+                continue
+            lows, highs = (data_frame[_e].to_numpy(dtype=float) for _e in bands[column])
+            # keep the lowest minima and the highest maxima of the band
+            positions = np.union1d(decimate(lows, budget), decimate(highs, budget))
+            points += len(positions)
+            ax1.fill_between(
+                timeline[positions],
+                lows[positions],
+                highs[positions],
+                color=lines[0].get_color(),
+                alpha=ENVELOPE_ALPHA,
+                linewidth=0,
+            )
+        # like pandas: the x-axis spans the data and shows concise date labels
+        ax1.margins(x=0)
+        locator = mdates.AutoDateLocator()  # type: ignore[no-untyped-call]
+        ax1.xaxis.set_major_locator(locator)
+        formatter = mdates.ConciseDateFormatter(locator)  # type: ignore[no-untyped-call]
+        ax1.xaxis.set_major_formatter(formatter)
+        ax1.set_ylabel(parameter)
+        if parameter in Y_LIMITS:
+            ax1.set_ylim(Y_LIMITS[parameter])
+        ax1.legend(loc="lower left", ncol=8, framealpha=0.2)
+        ax1.set_xlabel("Datetime")
+        ax1.grid(which="major", axis="y", color="k", linestyle="--", linewidth=0.5)
+        ax1.set_title(plot_title)
+        fig.tight_layout()
+        fig.savefig(output_file, format="png")
+    return {
+        "graph": output_file,
+        "wall": time.perf_counter() - wall,
+        "cpu": time.process_time() - cpu,
+        "rows": len(data_frame),
+        "points": points,
+        "bytes": os.path.getsize(output_file),
+    }
+
+
+def plot_all(graphs: list[tuple[str, str, pd.DataFrame, str]], max_workers: int) -> list[dict]:
+    """Render the graphs in parallel.
+
+    Args:
+        graphs: arguments of `plot()` for every graph
+        max_workers: maximum number of processes; 1 renders in this process
+
+    Returns:
+        what `plot()` returned for every graph
+    """
+    workers = max(1, min(len(graphs), max_workers))
+    if workers == 1:
+        return [plot(*_graph) for _graph in graphs]
+    # forked workers inherit the imported modules, so they start rendering right away
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, mp_context=mp.get_context("fork")
+    ) as executor:
+        futures = [executor.submit(plot, *_graph) for _graph in graphs]
+        # raises the exception of a failed graph here
+        return [_future.result() for _future in futures]
+
+
+class Fingerprints:
+    """Fingerprints of the graphs that were rendered before; kept in one JSON file."""
+
+    def __init__(self, path: str) -> None:
+        """Load the fingerprints of the previous run.
+
+        Args:
+            path: file to keep the fingerprints in; its directory is created if needed
+        """
+        self.path: str = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(path, encoding="utf-8") as _f:
+                self.known: dict[str, str] = json.load(_f)
+        except (OSError, ValueError):
+            # missing or damaged; render everything
+            self.known = {}
+
+    @staticmethod
+    def fingerprint(parameter: str, data_frame: pd.DataFrame, plot_title: str) -> str:
+        """Return a hash of the data of a graph and the options it is rendered with.
+
+        Args:
+            parameter: name of the parameter
+            data_frame: data to plot
+            plot_title: title without the time of rendering
+        """
+        digest = hashlib.sha256()
+        options: list[Any] = [parameter, plot_title, [str(_c) for _c in data_frame.columns]]
+        options += [FIG_SIZE, FIG_FONTSIZE, ALPHA, Y_LIMITS.get(parameter), DECIMATION]
+        options += [ENVELOPE, ENVELOPE_ALPHA]
+        digest.update(json.dumps(options).encode())
+        digest.update(pd.util.hash_pandas_object(data_frame, index=True).to_numpy().tobytes())
+        return digest.hexdigest()
+
+    def changed(
+        self, output_file: str, parameter: str, data_frame: pd.DataFrame, plot_title: str
+    ) -> bool:
+        """Return True if `output_file` must be rendered (again); remember its fingerprint.
+
+        Args:
+            output_file: name of the PNG file
+            parameter: name of the parameter
+            data_frame: data to plot
+            plot_title: title without the time of rendering
+        """
+        fingerprint = self.fingerprint(parameter, data_frame, plot_title)
+        if self.known.get(output_file) == fingerprint and os.path.isfile(output_file):
+            return False
+        self.known[output_file] = fingerprint
+        return True
+
+    def save(self) -> None:
+        """Store the fingerprints; call this after the graphs were rendered."""
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as _f:
+            json.dump(self.known, _f, indent=1)
+        os.replace(f"{self.path}.tmp", self.path)
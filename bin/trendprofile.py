@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# kimnaty
+# Copyright (C) 2024  Maurice (mausy5043) Hendrix
+# AGPL-3.0-or-later  - see LICENSE
+
+"""Measure the stages of a trend run.
+
+Every stage (e.g. the query of a table or the resampling of a room) is
+recorded with its wall time, CPU time and the number of rows and bytes it
+produced. The records and a summary per stage are written as a JSON report.
+A disabled profiler only reads the clocks, so the stages can stay instrumented.
+"""
+
+import contextlib
+import json
+import sys
+import time
+from collections.abc import Iterator
+
+import pandas as pd
+
+
+class Profiler:
+    """Collect the measurements of the stages of a run."""
+
+    def __init__(self, enabled: bool = False) -> None:
+        """Initialise the profiler.
+
+        Args:
+            enabled: record the stages; if False nothing is recorded
+        """
+        self.enabled: bool = enabled
+        self.records: list[dict] = []
+        self._start: tuple[float, float] = (time.perf_counter(), time.process_time())
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **labels: str) -> Iterator[dict]:
+        """Measure the code in the `with` block as stage `name`.
+
+        The block may add to the yielded record, e.g. with `count()`.
+
+        Args:
+            name: name of the stage
+            labels: what the stage worked on, e.g. table="data" or room="1.1"
+        """
+        record: dict = {"stage": name, **labels}
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            if self.enabled:
+                record["wall"] = time.perf_counter() - wall
+                record["cpu"] = time.process_time() - cpu
+                self.records.append(record)
+
+    def count(self, record: dict, df: pd.DataFrame) -> None:
+        """Add the number of rows and bytes of `df` to `record`."""
+        if self.enabled:
+            record["rows"] = record.get("rows", 0) + len(df)
+            record["bytes"] = record.get("bytes", 0) + int(df.memory_usage(deep=True).sum())
+
+    def add(self, record: dict) -> None:
+        """Add a stage that was measured elsewhere, e.g. in another process."""
+        if self.enabled:
+            self.records.append(record)
+
+    def summary(self) -> dict[str, dict]:
+        """Return the totals per stage."""
+        totals: dict[str, dict] = {}
+        for record in self.records:
+            total = totals.setdefault(
+                record["stage"], {"count": 0, "wall": 0.0, "cpu": 0.0, "rows": 0, "bytes": 0}
+            )
+            total["count"] += 1
+            for key in ("wall", "cpu", "rows", "bytes"):
+                total[key] += record.get(key, 0)
+        return totals
+
+    def report(self, path: str) -> None:
+        """Write the records, the totals per stage and of the whole run as JSON to `path`.
+
+        A `path` of "-" writes the report to stdout.
+        """
+        report = {
+            "argv": sys.argv,
+            "wall": time.perf_counter() - self._start[0],
+            "cpu": time.process_time() - self._start[1],
+            "summary": self.summary(),
+            "stages": self.records,
+        }
+        if path == "-":
+            json.dump(report, sys.stdout, indent=1)
+            print()
+            return
+        with open(path, "w", encoding="utf-8") as _f:
+            json.dump(report, _f, indent=1)